@@ -0,0 +1,460 @@
+"""Núcleo de cálculo da apuração fiscal, sem dependência de Streamlit.
+
+Usado pela interface (``relatorio_fiscal``), pelo processamento em lote
+(``lote``) e pela linha de comando (``cli``).
+"""
+import logging
+import re
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from .meses import MESES_PT, MES_PARA_NUM
+from .dados import ano_mes_do_periodo, moeda_para_centavos, preparar_notas
+from .cubo import como_cubo, eh_tributavel, fatiar
+from .transporte import transportar_creditos
+
+# Alíquotas em pontos-base (1/10.000): 925 = 9,25%. Os valores circulam em
+# centavos int64 e só viram reais (float) nas linhas dos relatórios.
+ALIQUOTA_PIS_COFINS_PB = 925
+ALIQUOTAS_ENTRADA_ICMS_PB = (400, 700, 1200, 1900)
+ALIQUOTAS_SAIDA_ICMS_PB = (1100, 1200, 1900)
+# adicional do Protege sobre as saídas a 11%
+PROTEGE_SAIDA_11_PB = 100
+ALIQUOTA_PIS_COFINS = ALIQUOTA_PIS_COFINS_PB / 10_000
+
+
+def parse_col(serie, colname=""):
+    """Converte uma coluna monetária em reais (float).
+
+    Colunas já preparadas em ``dados.preparar_notas`` dispensam esta chamada.
+    """
+    numeric = moeda_para_centavos(serie) / 100
+    logging.debug(f"[parse_col] [{colname}] Amostra: {numeric.head(5).tolist()}")
+    return numeric
+
+
+def moeda_format(valor):
+    """Formata valor para padrão brasileiro: R$ 12.345,67"""
+    try:
+        if isinstance(valor, str):
+            # Remove tudo exceto dígitos e vírgula
+            valor = re.sub(r'[^\d,]', '', valor)
+            # Converte vírgula para ponto para processamento
+            valor = valor.replace(',', '.')
+        valor = float(valor)
+        return f"R$ {valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    except:
+        return "R$ 0,00"
+
+
+def moeda_to_float(valor_texto):
+    """Converte texto no formato brasileiro para float"""
+    try:
+        if not valor_texto:
+            return 0.0
+        # Remove tudo exceto dígitos e vírgula
+        valor = re.sub(r'[^\d,]', '', valor_texto)
+        # Converte vírgula para ponto
+        valor = valor.replace(',', '.')
+        return float(valor)
+    except:
+        return 0.0
+
+
+def aplicar_aliquota(centavos, pontos_base):
+    """Imposto em centavos sobre uma base em centavos, com alíquota em pontos-base.
+
+    Arredonda meio centavo para longe do zero: ``(base * 925 + 5000) // 10000``
+    para bases positivas. Aceita escalares ou arrays e devolve int64.
+    """
+    centavos = np.asarray(centavos, dtype=np.int64)
+    imposto = (np.abs(centavos) * pontos_base + 5_000) // 10_000
+    return np.sign(centavos) * imposto
+
+
+COLUNAS_TOTAIS = ["liq_entradas", "liq_saidas", "icms_entradas", "icms_saidas"]
+
+
+def totais_por_periodo(cubo):
+    """Totais de valor líquido e ICMS por período (ano * 12 + mes - 1), de todos os anos.
+
+    Colunas ``liq_entradas``, ``liq_saidas``, ``icms_entradas`` e
+    ``icms_saidas`` (entradas = Mercadoria para Revenda ou Frete), em
+    centavos int64. Só aparecem os períodos com notas.
+    """
+    base = cubo[cubo["ano"] > 0] if not cubo.empty else cubo
+    if base.empty:
+        return pd.DataFrame(columns=COLUNAS_TOTAIS, dtype=np.int64, index=pd.Index([], name="periodo"))
+
+    tipo = base["Tipo"]
+    grupo = np.where(
+        tipo.eq("Saída"), "saidas",
+        np.where(tipo.eq("Entrada") & eh_tributavel(base["grupo"]), "entradas", ""),
+    )
+    base = base.assign(
+        grupo=grupo, periodo=base["ano"].astype(np.int64) * 12 + base["mes"].astype(np.int64) - 1
+    ).rename(columns={"valor_liquido": "liq", "valor_icms": "icms"})
+    somas = (
+        base[base["grupo"] != ""]
+        .groupby(["periodo", "grupo"])[["liq", "icms"]].sum()
+        .unstack("grupo", fill_value=0)
+    )
+    somas.columns = [f"{valor}_{grupo}" for valor, grupo in somas.columns]
+    return somas.reindex(columns=COLUNAS_TOTAIS, fill_value=0).astype(np.int64)
+
+
+def _totais_mensais(cubo, ano):
+    """Totais de ``totais_por_periodo`` só do ``ano``, indexados pelos meses 1..12."""
+    totais = totais_por_periodo(fatiar(cubo, ano))
+    totais.index = totais.index - (ano * 12 - 1)
+    return totais.reindex(index=range(1, 13), fill_value=0).astype(np.int64)
+
+
+def _creditos_debitos(totais, meses):
+    """Arrays (tributos × meses) de créditos e débitos: linha 0 = ICMS, linha 1 = PIS/COFINS."""
+    linhas = totais.loc[list(meses)]
+    creditos = np.array([
+        linhas["icms_entradas"].to_numpy(), aplicar_aliquota(linhas["liq_entradas"], ALIQUOTA_PIS_COFINS_PB)
+    ])
+    debitos = np.array([
+        linhas["icms_saidas"].to_numpy(), aplicar_aliquota(linhas["liq_saidas"], ALIQUOTA_PIS_COFINS_PB)
+    ])
+    return creditos.reshape(2, -1), debitos.reshape(2, -1)
+
+
+# Razão de créditos: uma linha por mês, do primeiro ao último período com
+# notas, sem quebra na virada do ano (o crédito de dezembro abre janeiro).
+TRIBUTOS_RAZAO = ("icms", "pc")
+COLUNAS_TRANSPORTE = ("credito_inicial", "a_pagar", "credito_final")
+COLUNAS_RAZAO = (
+    ["ano", "mes"] + COLUNAS_TOTAIS + ["pc_entradas", "pc_saidas"]
+    + [f"{tributo}_{nome}" for tributo in TRIBUTOS_RAZAO for nome in COLUNAS_TRANSPORTE]
+)
+
+
+def montar_razao(cubo):
+    """Razão contínuo de créditos de ICMS e PIS/COFINS, em centavos int64.
+
+    Indexado por ``periodo`` (ano * 12 + mes - 1) sem lacunas: meses sem
+    notas entram com zero e só carregam o saldo. O transporte corre uma
+    única vez por todos os anos; depois disso o saldo de abertura de
+    qualquer mês é uma consulta (``saldo_do_razao``).
+    """
+    totais = totais_por_periodo(cubo)
+    if totais.empty:
+        return pd.DataFrame(columns=COLUNAS_RAZAO, dtype=np.int64, index=pd.RangeIndex(0, name="periodo"))
+    indice = pd.RangeIndex(totais.index.min(), totais.index.max() + 1, name="periodo")
+    razao = totais.reindex(indice, fill_value=0)
+    razao.insert(0, "ano", indice // 12)
+    razao.insert(1, "mes", indice % 12 + 1)
+    razao["pc_entradas"] = aplicar_aliquota(razao["liq_entradas"], ALIQUOTA_PIS_COFINS_PB)
+    razao["pc_saidas"] = aplicar_aliquota(razao["liq_saidas"], ALIQUOTA_PIS_COFINS_PB)
+    for tributo in TRIBUTOS_RAZAO:
+        for nome in COLUNAS_TRANSPORTE:
+            razao[f"{tributo}_{nome}"] = np.int64(0)
+    return transportar_razao(razao)
+
+
+def transportar_razao(razao, desde=None):
+    """Refaz o transporte do razão a partir do período ``desde`` (padrão: o primeiro).
+
+    Os meses anteriores a ``desde`` são mantidos e o saldo final do mês
+    anterior abre o trecho recalculado. Retorna uma cópia.
+    """
+    razao = razao.copy()
+    if razao.empty:
+        return razao
+    inicio = razao.index[0] if desde is None else min(max(desde, razao.index[0]), razao.index[-1])
+    pos = razao.index.get_loc(inicio)
+    anterior = (
+        [0, 0] if pos == 0
+        else [razao[f"{tributo}_credito_final"].iat[pos - 1] for tributo in TRIBUTOS_RAZAO]
+    )
+    trecho = razao.iloc[pos:]
+    transporte = transportar_creditos(
+        np.array([trecho[f"{tributo}_entradas"].to_numpy() for tributo in TRIBUTOS_RAZAO], dtype=np.int64),
+        np.array([trecho[f"{tributo}_saidas"].to_numpy() for tributo in TRIBUTOS_RAZAO], dtype=np.int64),
+        np.array(anterior, dtype=np.int64),
+    )
+    for i, tributo in enumerate(TRIBUTOS_RAZAO):
+        for nome in COLUNAS_TRANSPORTE:
+            razao.iloc[pos:, razao.columns.get_loc(f"{tributo}_{nome}")] = transporte[nome][i]
+    return razao
+
+
+def saldo_do_razao(razao, ano, mes):
+    """Créditos (ICMS, PIS/COFINS) em centavos disponíveis no início de ``mes``/``ano``.
+
+    Antes do primeiro período do razão o saldo é zero; depois do último,
+    vale o crédito final do último mês.
+    """
+    if razao is None or razao.empty:
+        return 0, 0
+    periodo = ano * 12 + mes - 1
+    if periodo <= razao.index[0]:
+        return 0, 0
+    if periodo > razao.index[-1]:
+        linha, coluna = razao.index[-1], "credito_final"
+    else:
+        linha, coluna = periodo, "credito_inicial"
+    return tuple(int(razao.at[linha, f"{tributo}_{coluna}"]) for tributo in TRIBUTOS_RAZAO)
+
+
+def _saldo_inicial_acumulado(df, ano, mes_inicial):
+    """Calcula créditos acumulados de ICMS e PIS/COFINS (em reais) antes de ``mes_inicial``."""
+    credito_icms, credito_pc = saldo_do_razao(montar_razao(como_cubo(df)), ano, mes_inicial)
+    return credito_icms / 100, credito_pc / 100
+
+
+def _transportar_trechos(creditos, debitos, credito_inicial, finais_fechados):
+    """``transportar_creditos`` por trechos de meses abertos.
+
+    ``finais_fechados[j]`` é ``None`` nos meses abertos e, nos fechados, o
+    par (ICMS, PIS/COFINS) de créditos finais gravado no fechamento: o
+    trecho seguinte parte dele. As colunas dos meses fechados ficam zeradas.
+    """
+    resultado = {
+        nome: np.zeros(creditos.shape, dtype=np.int64)
+        for nome in ("credito_inicial", "consumo", "a_pagar", "credito_final")
+    }
+    atual = np.asarray(credito_inicial, dtype=np.int64)
+    j, n = 0, creditos.shape[-1]
+    while j < n:
+        if finais_fechados[j] is not None:
+            atual = np.asarray(finais_fechados[j], dtype=np.int64)
+            j += 1
+            continue
+        k = j
+        while k < n and finais_fechados[k] is None:
+            k += 1
+        transporte = transportar_creditos(creditos[:, j:k], debitos[:, j:k], atual)
+        for nome, valores in transporte.items():
+            resultado[nome][:, j:k] = valores
+        atual = transporte["credito_final"][:, -1]
+        j = k
+    return resultado
+
+
+def _finais_fechamento(registro):
+    if registro is None:
+        return None
+    return [registro["razao"][f"{tributo}_credito_final"] for tributo in TRIBUTOS_RAZAO]
+
+
+def aplicar_fechamentos(razao, fechamentos):
+    """Razão com os meses fechados congelados nos valores gravados.
+
+    ``fechamentos`` é ``{periodo: registro}`` (ver ``fechamento.fechamentos_ativos``).
+    Os meses abertos são retransportados, cada trecho partindo do crédito
+    final do último mês fechado antes dele. Retorna uma cópia.
+    """
+    if not fechamentos:
+        return razao
+    periodos = list(razao.index) + list(fechamentos)
+    indice = pd.RangeIndex(min(periodos), max(periodos) + 1, name="periodo")
+    razao = razao.reindex(indice, fill_value=0)
+    razao["ano"], razao["mes"] = indice // 12, indice % 12 + 1
+
+    fechados = [fechamentos.get(periodo) for periodo in indice]
+    for periodo, registro in zip(indice, fechados):
+        if registro is not None:
+            razao.loc[periodo, list(registro["razao"])] = list(registro["razao"].values())
+    transporte = _transportar_trechos(
+        np.array([razao[f"{tributo}_entradas"].to_numpy() for tributo in TRIBUTOS_RAZAO], dtype=np.int64),
+        np.array([razao[f"{tributo}_saidas"].to_numpy() for tributo in TRIBUTOS_RAZAO], dtype=np.int64),
+        [0, 0], [_finais_fechamento(registro) for registro in fechados],
+    )
+    abertos = np.array([registro is None for registro in fechados])
+    for i, tributo in enumerate(TRIBUTOS_RAZAO):
+        for nome in COLUNAS_TRANSPORTE:
+            coluna = razao[f"{tributo}_{nome}"].to_numpy(dtype=np.int64, copy=True)
+            coluna[abertos] = transporte[nome][i][abertos]
+            razao[f"{tributo}_{nome}"] = coluna
+    return razao.astype(np.int64)
+
+
+def _linha_relatorio(ano, mes, valores):
+    """Linha do relatório em reais a partir dos valores do mês em centavos (chaves do razão)."""
+    reais = {chave: int(valor) / 100 for chave, valor in valores.items()}
+    return {
+        "Ano": ano,
+        "Mês": MESES_PT[mes],
+        "Entradas (Revenda + Frete)": reais["liq_entradas"],
+        "Saídas": reais["liq_saidas"],
+        "Resultado Líquido": (int(valores["liq_saidas"]) - int(valores["liq_entradas"])) / 100,
+        "ICMS Entradas": reais["icms_entradas"],
+        "ICMS Saídas": reais["icms_saidas"],
+        "Crédito ICMS Acum. (início)": reais["icms_credito_inicial"],
+        "ICMS a Pagar": reais["icms_a_pagar"],
+        "Crédito ICMS Transportado": reais["icms_credito_final"],
+        "PIS/COFINS Entradas": reais["pc_entradas"],
+        "PIS/COFINS Saídas": reais["pc_saidas"],
+        "Crédito PIS/COFINS Acum. (início)": reais["pc_credito_inicial"],
+        "PIS/COFINS a Pagar": reais["pc_a_pagar"],
+        "Crédito PIS/COFINS Transportado": reais["pc_credito_final"],
+    }
+
+
+def calcular_resumo_fiscal_mes_a_mes(df, ano_sel, meses_sel, considerar_acumulo_previos=True, cubo=None,
+                                     razao=None, fechamentos=None):
+    """Apuração mês a mês de ICMS e PIS/COFINS.
+
+    ``cubo`` (ver ``cubo.montar_cubo``) evita reagregar as notas quando já
+    existe uma versão materializada; sem ele o cubo é montado a partir de ``df``.
+    Com ``considerar_acumulo_previos`` o crédito de abertura vem do razão
+    (``montar_razao``), inclusive o transportado de anos anteriores; passe
+    ``razao`` quando o ``cubo`` tiver só o ano selecionado.
+    Meses em ``fechamentos`` (``{periodo: registro}``) saem do registro
+    gravado, sem recálculo; os abertos seguem a partir dele.
+    Erros sobem para quem chamou (a interface os trata; lote e CLI os registram).
+    """
+    cubo = cubo if cubo is not None else como_cubo(df)
+    totais = _totais_mensais(cubo, ano_sel)
+    fechamentos = fechamentos or {}
+
+    if meses_sel:
+        if all(isinstance(m, int) for m in meses_sel):
+            meses_num = meses_sel
+        else:
+            meses_num = [MES_PARA_NUM.get(m, None) for m in meses_sel if m in MES_PARA_NUM]
+        meses_num = [m for m in meses_num if m]
+    else:
+        meses_num = list(range(1, 13))
+
+    credito_icms_acumulado = 0
+    credito_pis_cofins_acumulado = 0
+    if considerar_acumulo_previos and meses_num:
+        razao = razao if razao is not None else montar_razao(cubo)
+        credito_icms_acumulado, credito_pis_cofins_acumulado = saldo_do_razao(
+            aplicar_fechamentos(razao, fechamentos), ano_sel, min(meses_num)
+        )
+
+    meses_num = sorted(meses_num)
+    fechados = [fechamentos.get(ano_sel * 12 + mes - 1) for mes in meses_num]
+    creditos, debitos = _creditos_debitos(totais, meses_num)
+    # tudo em centavos até aqui; as linhas do relatório saem em reais
+    transporte = _transportar_trechos(
+        creditos, debitos, [credito_icms_acumulado, credito_pis_cofins_acumulado],
+        [_finais_fechamento(registro) for registro in fechados],
+    )
+    relatorio_mensal = []
+
+    for j, mes in enumerate(meses_num):
+        if fechados[j] is not None:
+            relatorio_mensal.append(_linha_relatorio(ano_sel, mes, fechados[j]["razao"]))
+            continue
+        linha = totais.loc[mes]
+        valores = {"liq_entradas": linha["liq_entradas"], "liq_saidas": linha["liq_saidas"]}
+        for i, tributo in enumerate(TRIBUTOS_RAZAO):
+            valores[f"{tributo}_entradas"] = creditos[i, j]
+            valores[f"{tributo}_saidas"] = debitos[i, j]
+            for nome in COLUNAS_TRANSPORTE:
+                valores[f"{tributo}_{nome}"] = transporte[nome][i, j]
+        relatorio_mensal.append(_linha_relatorio(ano_sel, mes, valores))
+
+    return relatorio_mensal
+
+
+def gerar_excel_resumo(relatorio_mensal):
+    buffer = BytesIO()
+    df_mensal = pd.DataFrame(relatorio_mensal)
+    with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
+        df_mensal.to_excel(writer, index=False, sheet_name="Resumo Fiscal Mês a Mês")
+    buffer.seek(0)
+    return buffer
+
+
+def format_brl(valor):
+    """Formata número para padrão brasileiro: R$ 12.345,67"""
+    if pd.isna(valor):
+        return "R$ 0,00"
+    return f"R$ {valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def _ultimo_mes_vigente(df):
+    """Ano e mês mais recentes das notas (ou do cubo); sem dados, o mês atual."""
+    df = preparar_notas(df) if df is not None else pd.DataFrame()
+    if "ano" in df.columns:
+        validas = df["ano"] > 0
+        periodos = df.loc[validas, "ano"].astype(int) * 12 + df.loc[validas, "mes"].astype(int) - 1
+    else:
+        periodos = pd.Series([], dtype=int)
+    if periodos.empty:
+        hoje = pd.Timestamp.today()
+        return hoje.year, hoje.month
+    return ano_mes_do_periodo(periodos.max())
+
+
+def _meses_restantes_do_ano(ano, mes_inicio):
+    return [(ano, m) for m in range(mes_inicio, 13)]
+
+
+def _credito_acumulado_atual(df, ano, mes_vig, imposto, razao=None):
+    if razao is None:
+        if df is None or df.empty:
+            return 0.0
+        razao = montar_razao(como_cubo(df))
+    credito_icms, credito_pc = saldo_do_razao(razao, ano, mes_vig)
+    return (credito_icms if imposto == "icms" else credito_pc) / 100
+
+
+def _rollforward(credito_inicial, creditos, debitos, periodos):
+    """Projeção de um tributo: entradas em centavos int64, linhas em reais."""
+    creditos = np.asarray(creditos, dtype=np.int64).reshape(-1)
+    debitos = np.asarray(debitos, dtype=np.int64).reshape(-1)
+    transporte = transportar_creditos(creditos[None], debitos[None], [int(credito_inicial)])
+    colunas = {nome: (valores[0] / 100).tolist() for nome, valores in transporte.items()}
+    return [
+        {
+            "Período": f"{ano}-{mes:02d}",
+            "Ano": ano,
+            "Mês": MESES_PT[mes],
+            "Crédito Inicial": colunas["credito_inicial"][j],
+            "Crédito do Mês": int(cred) / 100,
+            "Débito do Mês": int(deb) / 100,
+            "Consumo": colunas["consumo"][j],
+            "A Pagar": colunas["a_pagar"][j],
+            "Crédito Final": colunas["credito_final"][j],
+        }
+        for j, ((ano, mes), cred, deb) in enumerate(zip(periodos, creditos, debitos))
+    ]
+
+
+def derive_kpis(df: pd.DataFrame) -> dict:
+    if df is None or df.empty:
+        return {
+            "total_a_pagar": 0.0,
+            "meses_com_pagamento": 0,
+            "primeiro_mes_pagamento": "-",
+            "valor_primeiro_mes": 0.0,
+            "credito_final_dezembro": 0.0,
+            "mes_maior_pagamento": "-",
+            "valor_maior_pagamento": 0.0,
+        }
+
+    total_a_pagar = float(df["A Pagar"].sum())
+    meses_pag = df[df["A Pagar"] > 0]
+    meses_com_pagamento = int((df["A Pagar"] > 0).sum())
+    if not meses_pag.empty:
+        primeiro = meses_pag.iloc[0]
+        primeiro_mes = f"{primeiro['Mês']}/{primeiro['Ano']}"
+        valor_primeiro = float(primeiro["A Pagar"])
+    else:
+        primeiro_mes = "-"
+        valor_primeiro = 0.0
+    ultimo = df.iloc[-1]
+    credito_final_dez = float(ultimo["Crédito Final"])
+    idxmax = df["A Pagar"].idxmax()
+    mes_maior = f"{df.loc[idxmax, 'Mês']}/{df.loc[idxmax, 'Ano']}"
+    valor_maior = float(df.loc[idxmax, "A Pagar"])
+    return {
+        "total_a_pagar": total_a_pagar,
+        "meses_com_pagamento": meses_com_pagamento,
+        "primeiro_mes_pagamento": primeiro_mes,
+        "valor_primeiro_mes": valor_primeiro,
+        "credito_final_dezembro": credito_final_dez,
+        "mes_maior_pagamento": mes_maior,
+        "valor_maior_pagamento": valor_maior,
+    }
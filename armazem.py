@@ -0,0 +1,170 @@
+import json
+import logging
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+from .cubo import classificar_grupo
+from .dados import (
+    carregar_notas, impressao_arquivo, ler_meta_cache, linhas_novas, pasta_cache, preparar_notas,
+)
+
+ESQUEMA_NOTAS = """
+CREATE TABLE notas (
+    aba TEXT,
+    data_emissao TEXT,
+    ano INTEGER,
+    mes INTEGER,
+    periodo INTEGER,
+    tipo TEXT,
+    classificacao TEXT,
+    grupo TEXT,
+    uf TEXT,
+    valor_liquido INTEGER,
+    valor_icms INTEGER
+)
+"""
+
+# O índice de período cobre todas as colunas do cubo: a agregação por ano
+# é respondida só pelo índice, sem tocar na tabela.
+INDICES_NOTAS = [
+    "CREATE INDEX idx_notas_periodo ON notas (ano, mes, tipo, grupo, uf, valor_liquido, valor_icms)",
+    "CREATE INDEX idx_notas_data ON notas (data_emissao)",
+    "CREATE INDEX idx_notas_tipo ON notas (tipo, grupo)",
+    "CREATE INDEX idx_notas_classificacao ON notas (classificacao)",
+    "CREATE INDEX idx_notas_uf ON notas (uf)",
+]
+
+SQL_CUBO = """
+SELECT ano, mes, tipo AS "Tipo", grupo, uf AS "UF Emitente",
+       SUM(valor_liquido) AS valor_liquido,
+       SUM(valor_icms) AS valor_icms,
+       COUNT(*) AS notas
+FROM notas
+{where}
+GROUP BY ano, mes, tipo, grupo, uf
+ORDER BY ano, mes, tipo, grupo, uf
+"""
+
+
+def caminho_armazem(path):
+    return pasta_cache(path) / "notas.sqlite"
+
+
+def _linhas_armazem(df):
+    df = preparar_notas(df)
+    coluna = lambda nome, padrao=None: df[nome] if nome in df.columns else padrao
+    return pd.DataFrame({
+        "aba": coluna("aba").astype(str) if "aba" in df.columns else None,
+        "data_emissao": df["Data Emissão"].dt.strftime("%Y-%m-%d"),
+        "ano": df["ano"],
+        "mes": df["mes"],
+        "periodo": df["periodo"],
+        "tipo": df["Tipo"],
+        "classificacao": coluna("Classificação"),
+        "grupo": classificar_grupo(df["Classificação"]),
+        "uf": coluna("UF Emitente"),
+        "valor_liquido": coluna("valor_liquido", 0),
+        "valor_icms": coluna("valor_icms", 0),
+    })
+
+
+def _inserir_notas(con, linhas):
+    colunas = list(linhas.columns)
+    # object: inteiros e textos do Python, nulos como None (NULL no banco)
+    valores = linhas.astype(object).where(linhas.notna(), None)
+    con.executemany(
+        f"INSERT INTO notas ({', '.join(colunas)}) VALUES ({', '.join('?' * len(colunas))})",
+        valores.itertuples(index=False, name=None),
+    )
+
+
+def gravar_armazem(df, caminho_db, versao, anexar=False):
+    """Grava as notas na tabela ``notas`` e registra a ``versao`` dos dados.
+
+    Com ``anexar=True`` as linhas são acrescentadas à tabela existente
+    (carga incremental); caso contrário a tabela e os índices são recriados.
+    Tudo numa só transação: quem consulta o banco ao mesmo tempo continua
+    vendo a versão anterior inteira até o COMMIT, nunca a tabela vazia.
+    """
+    con = sqlite3.connect(caminho_db, isolation_level=None)
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            con.execute("CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT)")
+            if not anexar:
+                con.execute("DROP TABLE IF EXISTS notas")
+                con.execute(ESQUEMA_NOTAS)
+            _inserir_notas(con, _linhas_armazem(df))
+            if not anexar:
+                for indice in INDICES_NOTAS:
+                    con.execute(indice)
+            con.execute(
+                "INSERT OR REPLACE INTO meta (chave, valor) VALUES ('versao', ?)",
+                (json.dumps(versao),),
+            )
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        if not anexar:
+            con.execute("ANALYZE")
+    finally:
+        con.close()
+
+
+def versao_armazem(caminho_db):
+    if not Path(caminho_db).exists():
+        return None
+    try:
+        with sqlite3.connect(caminho_db) as con:
+            linha = con.execute("SELECT valor FROM meta WHERE chave = 'versao'").fetchone()
+    except sqlite3.Error:
+        return None
+    return json.loads(linha[0]) if linha else None
+
+
+def sincronizar_armazem(path):
+    """Garante que o SQLite ao lado da planilha corresponde à versão atual dela.
+
+    A versão é o sha256 registrado no cache de notas. Depois de uma carga
+    incremental só as linhas novas são inseridas. As notas só passam pela
+    memória durante a carga; depois disso as consultas são respondidas pelo banco.
+    """
+    caminho_db = caminho_armazem(path)
+    atual = versao_armazem(caminho_db)
+    meta = ler_meta_cache(path)
+    if meta and list(impressao_arquivo(path) or []) == [meta["tamanho"], meta["mtime_ns"]] \
+            and atual == meta["sha256"]:
+        return caminho_db
+
+    df = carregar_notas(path)
+    meta = ler_meta_cache(path) or {}
+    if atual is not None and atual == meta.get("sha256"):
+        return caminho_db
+    caminho_db.parent.mkdir(exist_ok=True)
+    delta = meta.get("delta")
+    if delta and atual == delta["de"]:
+        gravar_armazem(linhas_novas(df, meta), caminho_db, meta["sha256"], anexar=True)
+    else:
+        logging.info(f"[armazem] Recarregando {caminho_db}")
+        gravar_armazem(df, caminho_db, meta.get("sha256"))
+    return caminho_db
+
+
+def consultar_cubo(caminho_db, ano=None, meses=None):
+    """Cubo de agregação (mesmo formato de ``cubo.montar_cubo``) calculado no SQLite.
+
+    Filtros de ano e meses são aplicados no banco, usando o índice de período.
+    """
+    filtros, params = [], []
+    if ano is not None:
+        filtros.append("ano = ?")
+        params.append(int(ano))
+    if meses:
+        filtros.append(f"mes IN ({', '.join('?' * len(meses))})")
+        params.extend(int(m) for m in meses)
+    where = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+    with sqlite3.connect(caminho_db) as con:
+        return pd.read_sql_query(SQL_CUBO.format(where=where), con, params=params)
@@ -0,0 +1,252 @@
+"""Projeção de ICMS e PIS/COFINS para muitos cenários de uma vez.
+
+Os cenários são linhas de arrays NumPy: bases de shape
+``(cenários, meses)`` ou ``(cenários, meses, alíquotas)``. O transporte do
+crédito usa ``transporte.transportar_creditos``, que percorre os meses
+vetorizando cada passo sobre todos os cenários.
+
+As bases entram e os resultados saem em reais, mas as contas são as do
+simulador: cada base vira centavos, o imposto de cada faixa é arredondado
+por ``aplicar_aliquota`` e o transporte roda em int64. Um cenário sem
+variação (o ponto 1× da sensibilidade) dá os mesmos valores do simulador.
+"""
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from .apuracao import (
+    ALIQUOTA_PIS_COFINS_PB, ALIQUOTAS_ENTRADA_ICMS_PB, ALIQUOTAS_SAIDA_ICMS_PB, PROTEGE_SAIDA_11_PB,
+    aplicar_aliquota,
+)
+from .dados import reais_para_centavos
+from .transporte import transportar_creditos
+
+# alíquotas em fração, para quem classifica notas pela alíquota efetiva (previsão)
+ALIQUOTAS_ENTRADA_ICMS = tuple(pb / 10_000 for pb in ALIQUOTAS_ENTRADA_ICMS_PB)
+ALIQUOTAS_SAIDA_ICMS = tuple(pb / 10_000 for pb in ALIQUOTAS_SAIDA_ICMS_PB)
+PERCENTIS = (5, 25, 50, 75, 95)
+
+
+def _soma_por_faixa(centavos, aliquotas_pb):
+    # imposto de cada faixa arredondado ao centavo, como no simulador, e depois somado
+    if centavos.shape[-1] != len(aliquotas_pb):
+        raise ValueError(f"esperadas {len(aliquotas_pb)} alíquotas na última dimensão, recebidas {centavos.shape[-1]}")
+    return aplicar_aliquota(centavos, np.array(aliquotas_pb)).sum(axis=-1)
+
+
+def creditos_debitos_icms(entradas, saidas):
+    """Créditos e débitos de ICMS por cenário e mês, em centavos int64.
+
+    ``entradas``: bases em reais ``(cenários, meses, 4)`` a 4/7/12/19%;
+    ``saidas``: bases em reais ``(cenários, meses, 3)`` a 11/12/19%.
+    """
+    saidas = reais_para_centavos(saidas)
+    creditos = _soma_por_faixa(reais_para_centavos(entradas), ALIQUOTAS_ENTRADA_ICMS_PB)
+    debitos = _soma_por_faixa(saidas, ALIQUOTAS_SAIDA_ICMS_PB) + aplicar_aliquota(saidas[..., 0], PROTEGE_SAIDA_11_PB)
+    return creditos, debitos
+
+
+def creditos_debitos_pis_cofins(base_entradas, base_saidas):
+    """Créditos e débitos de PIS/COFINS (9,25%) por cenário e mês, em centavos int64."""
+    return (
+        aplicar_aliquota(reais_para_centavos(base_entradas), ALIQUOTA_PIS_COFINS_PB),
+        aplicar_aliquota(reais_para_centavos(base_saidas), ALIQUOTA_PIS_COFINS_PB),
+    )
+
+
+def projetar_cenarios(credito_inicial, creditos, debitos, meses=None):
+    """Transporta o crédito mês a mês em todos os cenários simultaneamente.
+
+    ``creditos``/``debitos`` têm shape ``(cenários, meses)``, em centavos
+    (de ``creditos_debitos_*``); ``credito_inicial`` é em reais, escalar ou
+    ``(cenários,)``. ``meses`` (números 1-12 das colunas) só é usado para
+    nomear o primeiro mês de pagamento. Retorna um dicionário de arrays,
+    os valores em reais:
+
+    - ``credito_inicial``, ``a_pagar``, ``credito_final``: ``(cenários, meses)``
+    - ``total_a_pagar`` e ``credito_final_dezembro``: ``(cenários,)``
+    - ``primeiro_mes_pagamento``: ``(cenários,)``, número do mês ou 0 se nenhum
+    """
+    creditos = np.atleast_2d(np.asarray(creditos, dtype=np.int64))
+    debitos = np.atleast_2d(np.asarray(debitos, dtype=np.int64))
+    creditos, debitos = np.broadcast_arrays(creditos, debitos)
+    n_cenarios, n_meses = creditos.shape
+    if meses is None:
+        meses = np.arange(1, n_meses + 1)
+    meses = np.asarray(meses)
+    if len(meses) != n_meses:
+        raise ValueError(f"{len(meses)} meses informados para {n_meses} colunas")
+
+    credito_inicial = reais_para_centavos(credito_inicial)
+    transporte = transportar_creditos(creditos, debitos, credito_inicial)
+    a_pagar, final = transporte["a_pagar"], transporte["credito_final"]
+
+    pagou = a_pagar > 0
+    primeiro = np.where(pagou.any(axis=1), meses[pagou.argmax(axis=1)], 0) if n_meses else np.zeros(n_cenarios, int)
+    resultado = {
+        "credito_inicial": transporte["credito_inicial"],
+        "a_pagar": a_pagar,
+        "credito_final": final,
+        "total_a_pagar": a_pagar.sum(axis=1),
+        "credito_final_dezembro": final[:, -1] if n_meses else np.broadcast_to(credito_inicial, (n_cenarios,)),
+    }
+    resultado = {medida: valores / 100 for medida, valores in resultado.items()}
+    resultado["primeiro_mes_pagamento"] = primeiro
+    return resultado
+
+
+def resumir_distribuicao(valores, percentis=PERCENTIS):
+    """Média, desvio e percentis de uma medida por cenário."""
+    valores = np.asarray(valores, dtype=float)
+    resumo = {"media": float(valores.mean()), "desvio": float(valores.std())}
+    resumo.update({f"p{p}": float(v) for p, v in zip(percentis, np.percentile(valores, percentis))})
+    return resumo
+
+
+def distribuicao_primeiro_pagamento(primeiro_mes):
+    """Fração dos cenários cujo primeiro pagamento cai em cada mês (0 = nenhum)."""
+    contagem = np.bincount(np.asarray(primeiro_mes, dtype=int), minlength=13)
+    return {mes: float(contagem[mes] / contagem.sum()) for mes in range(13) if contagem[mes]}
+
+
+def amostrar_bases(base, n_cenarios, variacao=0.10, semente=None):
+    """Cenários Monte Carlo em torno de ``base`` (``(meses, ...)``).
+
+    Cada célula é multiplicada por um fator lognormal de média 1 e desvio
+    relativo ``variacao``; o resultado tem shape ``(n_cenarios, *base.shape)``.
+    """
+    base = np.asarray(base, dtype=float)
+    rng = np.random.default_rng(semente)
+    sigma = np.sqrt(np.log1p(variacao ** 2))
+    fatores = rng.lognormal(-sigma ** 2 / 2, sigma, size=(n_cenarios, *base.shape))
+    return base * fatores
+
+
+def monte_carlo_icms(credito_inicial, entradas, saidas, meses=None, n_cenarios=10_000, variacao=0.10, semente=None):
+    """Distribuições de ICMS a pagar, primeiro mês de pagamento e crédito de dezembro.
+
+    ``entradas`` ``(meses, 4)`` e ``saidas`` ``(meses, 3)`` são as bases
+    esperadas; cada cenário sorteia variações independentes em torno delas.
+    """
+    creditos, debitos = creditos_debitos_icms(
+        amostrar_bases(entradas, n_cenarios, variacao, semente),
+        amostrar_bases(saidas, n_cenarios, variacao, None if semente is None else semente + 1),
+    )
+    return _distribuicoes(projetar_cenarios(credito_inicial, creditos, debitos, meses))
+
+
+def monte_carlo_pis_cofins(credito_inicial, base_entradas, base_saidas, meses=None, n_cenarios=10_000,
+                           variacao=0.10, semente=None):
+    """Como ``monte_carlo_icms``, com bases ``(meses,)`` de entradas e saídas a 9,25%."""
+    creditos, debitos = creditos_debitos_pis_cofins(
+        amostrar_bases(base_entradas, n_cenarios, variacao, semente),
+        amostrar_bases(base_saidas, n_cenarios, variacao, None if semente is None else semente + 1),
+    )
+    return _distribuicoes(projetar_cenarios(credito_inicial, creditos, debitos, meses))
+
+
+def _distribuicoes(resultado):
+    return {
+        "total_a_pagar": resumir_distribuicao(resultado["total_a_pagar"]),
+        "credito_final_dezembro": resumir_distribuicao(resultado["credito_final_dezembro"]),
+        "primeiro_mes_pagamento": distribuicao_primeiro_pagamento(resultado["primeiro_mes_pagamento"]),
+        "cenarios": resultado,
+    }
+
+
+DRIVERS = {
+    "icms": {
+        "volume_entradas": "Volume de entradas (×)",
+        "volume_saidas": "Volume de saídas (×)",
+        "participacao_4": "Participação de 4% nas entradas 4% + 12%",
+    },
+    "pc": {
+        "volume_entradas": "Volume de entradas (×)",
+        "volume_saidas": "Volume de saídas (×)",
+    },
+}
+METRICAS_GRADE = ("total_a_pagar", "credito_final_dezembro", "primeiro_mes_pagamento", "meses_com_pagamento")
+LIMITE_CACHE_GRADE = 200_000
+
+
+def _aplicar_driver(driver, valores, entradas, saidas):
+    # ``valores`` (cenários,); bases (cenários, meses, alíquotas)
+    v = np.asarray(valores, dtype=float)[:, None, None]
+    if driver == "volume_entradas":
+        return entradas * v, saidas
+    if driver == "volume_saidas":
+        return entradas, saidas * v
+    if driver == "participacao_4":
+        # redistribui o que entrou a 4% e a 12%, mantendo a soma das duas faixas
+        soma = entradas[..., 0] + entradas[..., 2]
+        entradas = entradas.copy()
+        entradas[..., 0] = soma * v[..., 0]
+        entradas[..., 2] = soma * (1 - v[..., 0])
+        return entradas, saidas
+    raise ValueError(f"driver desconhecido: {driver}")
+
+
+def _bases_por_aliquota(imposto, entradas, saidas):
+    # PIS/COFINS tem uma única base por mês; vira (meses, 1) para usar os mesmos drivers
+    entradas, saidas = np.asarray(entradas, dtype=float), np.asarray(saidas, dtype=float)
+    if imposto == "pc":
+        return entradas.reshape(-1, 1), saidas.reshape(-1, 1)
+    return entradas, saidas
+
+
+def avaliar_pontos(imposto, credito_inicial, entradas, saidas, driver_x, driver_y, pontos, meses=None):
+    """Projeta o restante do ano em cada ponto ``(x, y)`` numa única passada vetorizada.
+
+    Retorna ``{métrica: array (pontos,)}`` com as métricas de ``METRICAS_GRADE``.
+    """
+    pontos = np.asarray(pontos, dtype=float).reshape(-1, 2)
+    entradas, saidas = _bases_por_aliquota(imposto, entradas, saidas)
+    n = len(pontos)
+    ent = np.broadcast_to(entradas, (n, *entradas.shape))
+    sai = np.broadcast_to(saidas, (n, *saidas.shape))
+    ent, sai = _aplicar_driver(driver_x, pontos[:, 0], ent, sai)
+    ent, sai = _aplicar_driver(driver_y, pontos[:, 1], ent, sai)
+    if imposto == "pc":
+        creditos, debitos = creditos_debitos_pis_cofins(ent[..., 0], sai[..., 0])
+    else:
+        creditos, debitos = creditos_debitos_icms(ent, sai)
+    resultado = projetar_cenarios(credito_inicial, creditos, debitos, meses)
+    resultado["meses_com_pagamento"] = (resultado["a_pagar"] > 0).sum(axis=1)
+    return {m: resultado[m] for m in METRICAS_GRADE}
+
+
+def _chave_base(imposto, credito_inicial, entradas, saidas, driver_x, driver_y, meses):
+    digest = hashlib.sha1()
+    for parte in (entradas, saidas, meses if meses is not None else ()):
+        arr = np.ascontiguousarray(parte, dtype=float)
+        digest.update(str(arr.shape).encode())
+        digest.update(arr.tobytes())
+    return (imposto, float(credito_inicial), driver_x, driver_y, digest.hexdigest())
+
+
+def grade_sensibilidade(imposto, credito_inicial, entradas, saidas, driver_x, xs, driver_y, ys,
+                        meses=None, cache=None):
+    """Varre dois drivers numa grade ``ys × xs`` e devolve ``{métrica: DataFrame}``.
+
+    ``cache`` (um dict mantido pelo chamador) guarda o resultado de cada
+    ponto por (bases, crédito inicial, drivers, x, y): ao mexer nos limites
+    da grade só os pontos ainda não vistos são calculados.
+    """
+    xs = np.round(np.asarray(xs, dtype=float), 9)
+    ys = np.round(np.asarray(ys, dtype=float), 9)
+    cache = {} if cache is None else cache
+    base = _chave_base(imposto, credito_inicial, entradas, saidas, driver_x, driver_y, meses)
+    pontos = [(x, y) for y in ys for x in xs]
+    faltando = list(dict.fromkeys(p for p in pontos if (base, *p) not in cache))
+    if faltando:
+        if len(cache) + len(faltando) > LIMITE_CACHE_GRADE:
+            cache.clear()
+        novos = avaliar_pontos(imposto, credito_inicial, entradas, saidas, driver_x, driver_y, faltando, meses)
+        for i, p in enumerate(faltando):
+            cache[(base, *p)] = tuple(novos[m][i].item() for m in METRICAS_GRADE)
+    valores = np.array([cache[(base, *p)] for p in pontos]).reshape(len(ys), len(xs), len(METRICAS_GRADE))
+    return {
+        m: pd.DataFrame(valores[..., i], index=pd.Index(ys, name=driver_y), columns=pd.Index(xs, name=driver_x))
+        for i, m in enumerate(METRICAS_GRADE)
+    }
@@ -0,0 +1,83 @@
+"""Apuração fiscal pela linha de comando, sem Streamlit.
+
+Exemplos (a partir da pasta que contém ``app``)::
+
+    python -m app.cli "U:\\...\\data\\notas_fiscais.xlsx" --ano 2025
+    python -m app.cli "U:\\...\\empresas" --ano 2025 --meses 1 2 3 --saida apuracao.xlsx
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+from .apuracao import format_brl, gerar_excel_resumo
+from .lote import NOME_PLANILHA, apurar_empresas, descobrir_empresas, nome_empresa
+
+
+def empresas_dos_caminhos(caminhos, nome=NOME_PLANILHA):
+    """Planilhas passadas diretamente e pastas a varrer viram ``{empresa: caminho}``."""
+    empresas = {}
+    for caminho in map(Path, caminhos):
+        if caminho.is_dir():
+            encontradas = descobrir_empresas(caminho, nome)
+        elif caminho.is_file():
+            encontradas = {nome_empresa(caminho, caminho.parent.parent): caminho}
+        else:
+            raise FileNotFoundError(caminho)
+        for empresa, path in encontradas.items():
+            empresas.setdefault(empresa, path)
+    return empresas
+
+
+def exportar(tabela, saida):
+    saida = Path(saida)
+    if saida.suffix.lower() == ".csv":
+        tabela.to_csv(saida, index=False, sep=";", decimal=",", encoding="utf-8-sig")
+    else:
+        saida.write_bytes(gerar_excel_resumo(tabela.to_dict("records")).getvalue())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m app.cli",
+        description="Apuração de ICMS e PIS/COFINS mês a mês de uma ou várias empresas.",
+    )
+    parser.add_argument("caminhos", nargs="+", help="planilhas de notas ou pastas com uma pasta por empresa")
+    parser.add_argument("--ano", type=int, required=True)
+    parser.add_argument("--meses", type=int, nargs="+", choices=range(1, 13), metavar="MES",
+                        default=list(range(1, 13)), help="meses a apurar (padrão: todos)")
+    parser.add_argument("--sem-acumulo", action="store_true",
+                        help="não transportar créditos dos meses anteriores (inclusive de anos passados)")
+    parser.add_argument("--saida", help="arquivo .xlsx ou .csv com a apuração consolidada")
+    parser.add_argument("--processos", type=int, default=None,
+                        help="processos em paralelo (padrão: um por núcleo)")
+    parser.add_argument("--nome", default=NOME_PLANILHA, help="nome da planilha procurada nas pastas")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s | %(message)s")
+    try:
+        empresas = empresas_dos_caminhos(args.caminhos, args.nome)
+    except FileNotFoundError as e:
+        parser.error(f"caminho não encontrado: {e}")
+    if not empresas:
+        parser.error("nenhuma planilha de notas encontrada")
+
+    tabela, erros = apurar_empresas(
+        empresas, args.ano, sorted(set(args.meses)),
+        considerar_acumulo_previos=not args.sem_acumulo, max_workers=args.processos,
+    )
+    for empresa, erro in erros.items():
+        print(f"ERRO {empresa}: {erro}", file=sys.stderr)
+
+    if args.saida:
+        exportar(tabela, args.saida)
+        print(f"{len(empresas) - len(erros)} empresas apuradas -> {args.saida}")
+    elif not tabela.empty:
+        colunas = ["Empresa", "Ano", "Mês", "ICMS a Pagar", "Crédito ICMS Transportado",
+                   "PIS/COFINS a Pagar", "Crédito PIS/COFINS Transportado"]
+        print(tabela[colunas].to_string(index=False, formatters={c: format_brl for c in colunas[3:]}))
+    return 1 if erros else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
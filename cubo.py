@@ -0,0 +1,152 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from .dados import (
+    VERSAO_CACHE, abrir_tabela, gravar_json, ler_json, ler_meta_cache, linhas_novas, pasta_cache,
+    preparar_notas, salvar_tabela,
+)
+
+CHAVES_CUBO = ["ano", "mes", "Tipo", "grupo", "UF Emitente"]
+VALORES_CUBO = ["valor_liquido", "valor_icms"]
+GRUPOS_TRIBUTAVEIS = ["Revenda", "Frete"]
+
+# Regras de classificação: o primeiro trecho encontrado em "Classificação"
+# (sem diferenciar maiúsculas) define o grupo; sem regra, vale GRUPO_PADRAO.
+# Novas regras entram só aqui.
+REGRAS_GRUPO = [
+    ("Mercadoria para Revenda", "Revenda"),
+    ("Frete", "Frete"),
+]
+GRUPO_PADRAO = "Outros"
+GRUPOS = list(dict.fromkeys([grupo for _, grupo in REGRAS_GRUPO] + [GRUPO_PADRAO]))
+CODIGOS_TRIBUTAVEIS = [GRUPOS.index(grupo) for grupo in GRUPOS_TRIBUTAVEIS]
+
+
+def grupo_da_classificacao(texto):
+    """Grupo de um texto de classificação, pela primeira regra que casar."""
+    if pd.isna(texto):
+        return GRUPO_PADRAO
+    texto = str(texto).casefold()
+    for trecho, grupo in REGRAS_GRUPO:
+        if trecho.casefold() in texto:
+            return grupo
+    return GRUPO_PADRAO
+
+
+def classificar_grupo(classificacao):
+    """Agrupa "Classificação" em Revenda, Frete ou Outros (categórico, categorias ``GRUPOS``).
+
+    As regras rodam uma vez por categoria distinta; cada nota só recebe,
+    pelo código da sua categoria, o código do grupo numa tabela de consulta.
+    """
+    if not isinstance(classificacao.dtype, pd.CategoricalDtype):
+        classificacao = classificacao.astype("category")
+    tabela = np.array(
+        [GRUPOS.index(grupo_da_classificacao(c)) for c in classificacao.cat.categories]
+        + [GRUPOS.index(GRUPO_PADRAO)],  # código -1 (vazio) cai na última posição
+        dtype=np.int8,
+    )
+    codigos = tabela[classificacao.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codigos, categories=GRUPOS), index=classificacao.index)
+
+
+def eh_tributavel(grupo):
+    """Máscara dos grupos tributáveis; com ``grupo`` categórico é uma comparação de códigos."""
+    if isinstance(grupo.dtype, pd.CategoricalDtype) and list(grupo.cat.categories) == GRUPOS:
+        return np.isin(grupo.cat.codes.to_numpy(), CODIGOS_TRIBUTAVEIS)
+    return grupo.isin(GRUPOS_TRIBUTAVEIS).to_numpy()
+
+
+def montar_cubo(df):
+    """Agrega as notas por (ano, mes, Tipo, grupo, UF Emitente).
+
+    O cubo guarda as somas de ``valor_liquido`` e ``valor_icms`` (centavos)
+    e a quantidade de notas; gráficos, KPIs e apurações leem dele em vez de
+    varrer as notas.
+    """
+    df = preparar_notas(df)
+    base = pd.DataFrame({
+        "ano": df["ano"],
+        "mes": df["mes"],
+        "Tipo": df["Tipo"],
+        "grupo": classificar_grupo(df["Classificação"]),
+        "UF Emitente": df["UF Emitente"] if "UF Emitente" in df.columns else None,
+        "valor_liquido": df["valor_liquido"] if "valor_liquido" in df.columns else 0,
+        "valor_icms": df["valor_icms"] if "valor_icms" in df.columns else 0,
+    })
+    cubo = (
+        base.groupby(CHAVES_CUBO, dropna=False, sort=True, observed=True)
+        .agg(
+            valor_liquido=("valor_liquido", "sum"),
+            valor_icms=("valor_icms", "sum"),
+            notas=("valor_liquido", "size"),
+        )
+        .reset_index()
+    )
+    return cubo
+
+
+def somar_cubos(*cubos):
+    """Soma cubos célula a célula (por exemplo, o cubo salvo + o cubo das notas novas)."""
+    juntos = pd.concat(cubos, ignore_index=True)
+    return (
+        juntos.groupby(CHAVES_CUBO, dropna=False, sort=True, observed=True)[VALORES_CUBO + ["notas"]]
+        .sum()
+        .reset_index()
+    )
+
+
+def cubo_da_planilha(path, df):
+    """Cubo persistido na pasta de cache da planilha, sincronizado com ``df``.
+
+    Se o cubo salvo corresponde à versão anterior e a última carga foi
+    incremental, só as notas novas são agregadas e somadas a ele.
+    """
+    pasta = pasta_cache(path)
+    meta = ler_meta_cache(path)
+    salvo = ler_json(pasta / "cubo.json")
+    # cubo gravado por outra versão do código (VERSAO_CACHE) não é reaproveitado
+    if meta and salvo and salvo.get("versao") == VERSAO_CACHE:
+        try:
+            if salvo["sha256"] == meta["sha256"]:
+                return abrir_tabela(pasta, salvo)
+            delta = meta.get("delta")
+            if delta and salvo["sha256"] == delta["de"]:
+                cubo = somar_cubos(abrir_tabela(pasta, salvo), montar_cubo(linhas_novas(df, meta)))
+            else:
+                cubo = montar_cubo(df)
+        except Exception as e:
+            logging.warning(f"[cubo] Falha ao reaproveitar cubo salvo: {e}")
+            cubo = montar_cubo(df)
+    else:
+        cubo = montar_cubo(df)
+    if meta:
+        try:
+            info = salvar_tabela(pasta, "cubo", cubo)
+            gravar_json(pasta / "cubo.json", {"versao": VERSAO_CACHE, "sha256": meta["sha256"], **info})
+        except OSError as e:
+            logging.warning(f"[cubo] Não foi possível gravar o cubo: {e}")
+    return cubo
+
+
+def eh_cubo(df):
+    return "grupo" in df.columns and "notas" in df.columns
+
+
+def como_cubo(df):
+    """Devolve ``df`` se já for um cubo; caso contrário agrega as notas."""
+    return df if eh_cubo(df) else montar_cubo(df)
+
+
+def fatiar(cubo, ano, meses=None, tipo=None, grupos=None):
+    """Filtra o cubo por ano, meses, Tipo e grupos de classificação."""
+    filtro = cubo["ano"] == ano
+    if meses:
+        filtro &= cubo["mes"].isin(meses)
+    if tipo is not None:
+        filtro &= cubo["Tipo"].eq(tipo)
+    if grupos is not None:
+        filtro &= cubo["grupo"].isin(grupos)
+    return cubo[filtro]
@@ -0,0 +1,396 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from .leitores import ler_abas
+
+ABAS_NOTAS = ["entradas", "saídas"]
+# colunas de texto com poucos valores distintos, guardadas como categóricas
+COLUNAS_CATEGORICAS = ["Tipo", "Classificação", "UF Emitente"]
+# Esquema das notas: só estas colunas (e as monetárias, "Valor ...") são lidas
+# da planilha; CNPJ, Observação e outras que os relatórios não usam ficam de fora.
+COLUNAS_NOTAS = ["Número", "Data Emissão"] + COLUNAS_CATEGORICAS
+# inteiros reduzidos ao menor tipo que comporta os valores
+COLUNAS_INTEIRAS = ["Número"]
+VERSAO_CACHE = 7
+ORIGEM_EXCEL = "1899-12-30"
+
+
+def impressao_arquivo(path):
+    """Retorna (tamanho, mtime_ns) da planilha — barato, usado como versão dos dados."""
+    try:
+        st_ = Path(path).stat()
+    except OSError:
+        return None
+    return st_.st_size, st_.st_mtime_ns
+
+
+def pasta_cache(path):
+    """Pasta oculta ao lado da planilha onde ficam os caches derivados dela."""
+    path = Path(path)
+    return path.parent / f".{path.stem}.cache"
+
+
+def ler_json(arquivo):
+    try:
+        return json.loads(Path(arquivo).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def gravar_atomico(destino, escrever):
+    """Chama ``escrever(tmp)`` num temporário exclusivo ao lado de ``destino`` e o renomeia.
+
+    Leitores nunca veem o arquivo pela metade, e gravações simultâneas (o
+    vigia e uma sessão, por exemplo) não escrevem no mesmo temporário.
+    """
+    destino = Path(destino)
+    fd, tmp = tempfile.mkstemp(dir=destino.parent, prefix=f".{destino.name}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        escrever(tmp)
+        os.replace(tmp, destino)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def gravar_json(arquivo, dados):
+    """Grava ``dados`` como JSON via ``gravar_atomico``."""
+    gravar_atomico(arquivo, lambda tmp: Path(tmp).write_text(json.dumps(dados), encoding="utf-8"))
+
+
+def ler_meta_cache(path):
+    """Metadados do cache de notas da planilha (tamanho, mtime, sha256, delta...)."""
+    meta = ler_json(pasta_cache(path) / "meta.json")
+    if meta and meta.get("versao") != VERSAO_CACHE:
+        return None
+    return meta
+
+
+def salvar_tabela(pasta, nome, df):
+    """Grava ``df`` em Parquet; colunas com tipos mistos caem para pickle.
+
+    Retorna ``{"formato", "arquivo"}`` para ser guardado nos metadados.
+    """
+    pasta.mkdir(exist_ok=True)
+    try:
+        gravar_atomico(pasta / f"{nome}.parquet", lambda tmp: df.to_parquet(tmp, index=False))
+        return {"formato": "parquet", "arquivo": f"{nome}.parquet"}
+    except (ImportError, ValueError, TypeError) as e:
+        logging.debug(f"[cache] Parquet indisponível para {nome} ({e}); usando pickle")
+        gravar_atomico(pasta / f"{nome}.pkl", df.to_pickle)
+        return {"formato": "pickle", "arquivo": f"{nome}.pkl"}
+
+
+def abrir_tabela(pasta, info):
+    arquivo = pasta / info["arquivo"]
+    if info["formato"] == "parquet":
+        return pd.read_parquet(arquivo)
+    return pd.read_pickle(arquivo)
+
+
+def nome_coluna(coluna):
+    """Nome snake_case da coluna derivada: "Valor Líquido" -> "valor_liquido"."""
+    texto = unicodedata.normalize("NFKD", str(coluna)).encode("ascii", "ignore").decode()
+    return re.sub(r"\W+", "_", texto.strip().lower()).strip("_")
+
+
+def eh_monetaria(coluna):
+    return str(coluna).strip().lower().startswith("valor ")
+
+
+def colunas_monetarias(df):
+    """Colunas da planilha com valores em reais ("Valor Líquido", "Valor ICMS", ...)."""
+    return [c for c in df.columns if eh_monetaria(c)]
+
+
+def coluna_do_esquema(coluna):
+    """True para as colunas da planilha que entram no DataFrame de notas (``usecols``)."""
+    return str(coluna).strip() in COLUNAS_NOTAS or eh_monetaria(coluna)
+
+
+def reais_para_centavos(valores):
+    """Reais (float) -> centavos int64, arredondando ao centavo mais próximo; NaN/inf viram 0."""
+    valores = np.asarray(valores, dtype=float)
+    return np.where(np.isfinite(valores), np.rint(valores * 100), 0).astype(np.int64)
+
+
+def moeda_para_centavos(serie):
+    """Converte uma coluna monetária (números ou texto "R$ 1.234,56") em centavos int64.
+
+    Cada valor distinto é interpretado uma única vez e o resultado é
+    espalhado de volta para as linhas; vazios e textos inválidos viram 0.
+    """
+    if pd.api.types.is_numeric_dtype(serie):
+        return pd.Series(reais_para_centavos(serie.to_numpy(dtype=float, na_value=np.nan)), index=serie.index)
+
+    codigos, distintos = pd.factorize(serie)
+    distintos = pd.Series(distintos, dtype=object)
+    eh_texto = distintos.map(lambda v: isinstance(v, str)).astype(bool)
+    numeros = pd.to_numeric(distintos.where(~eh_texto), errors="coerce")
+    if eh_texto.any():
+        texto = distintos[eh_texto].str.replace(r"[^\d,.\-]", "", regex=True)
+        # "1234.56" (ponto decimal) é aceito; nos demais casos o ponto é separador de milhar
+        ponto_decimal = ~texto.str.contains(",", regex=False) & texto.str.fullmatch(r"-?\d+\.\d{1,2}")
+        texto = texto.where(
+            ponto_decimal,
+            texto.str.replace(".", "", regex=False).str.replace(",", ".", regex=False),
+        )
+        numeros[eh_texto] = pd.to_numeric(texto, errors="coerce")
+    centavos = np.append(reais_para_centavos(numeros), 0)  # código -1 (vazio) -> 0
+    return pd.Series(centavos[codigos], index=serie.index)
+
+
+def datas_para_datetime(serie):
+    """Converte "Data Emissão" em datetime64, interpretando cada valor distinto uma vez.
+
+    Aceita textos "dd/mm/aaaa", datas reais e números seriais do Excel;
+    valores irreconhecíveis viram NaT.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    if pd.api.types.is_numeric_dtype(serie):
+        return pd.to_datetime(serie, unit="D", origin=ORIGEM_EXCEL, errors="coerce")
+
+    codigos, distintos = pd.factorize(serie)
+    distintos = pd.Series(distintos, dtype=object)
+    eh_texto = distintos.map(lambda v: isinstance(v, str)).astype(bool)
+    eh_numero = distintos.map(lambda v: isinstance(v, (int, float, np.number)) and not isinstance(v, bool)).astype(bool)
+    datas = pd.Series(pd.NaT, index=distintos.index, dtype="datetime64[ns]")
+    if eh_texto.any():
+        texto = distintos[eh_texto].str.strip()
+        convertidas = pd.to_datetime(texto, format="%d/%m/%Y", errors="coerce")
+        falhas = convertidas.isna()
+        if falhas.any():
+            convertidas[falhas] = pd.to_datetime(texto[falhas], format="mixed", dayfirst=True, errors="coerce")
+        datas[eh_texto] = convertidas
+    if eh_numero.any():
+        datas[eh_numero] = pd.to_datetime(
+            distintos[eh_numero].astype(float), unit="D", origin=ORIGEM_EXCEL, errors="coerce"
+        )
+    outros = ~(eh_texto | eh_numero)
+    if outros.any():
+        datas[outros] = pd.to_datetime(distintos[outros], errors="coerce")
+    valores = np.append(datas.to_numpy(), np.datetime64("NaT"))  # código -1 (vazio) -> NaT
+    return pd.Series(valores[codigos], index=serie.index, name=serie.name)
+
+
+def _chaves_periodo(datas):
+    """``ano``/``mes``/``periodo`` (ano * 12 + mes - 1) em int16; datas inválidas ficam 0."""
+    validas = datas.notna().to_numpy()
+    ano = np.where(validas, datas.dt.year.fillna(0).to_numpy(), 0).astype(np.int16)
+    mes = np.where(validas, datas.dt.month.fillna(0).to_numpy(), 0).astype(np.int16)
+    periodo = np.where(validas, ano.astype(np.int32) * 12 + mes - 1, 0).astype(np.int16)
+    return {"ano": ano, "mes": mes, "periodo": periodo}
+
+
+def ano_mes_do_periodo(periodo):
+    return int(periodo) // 12, int(periodo) % 12 + 1
+
+
+def preparar_notas(df):
+    """Tipa as colunas das notas uma única vez, logo após a leitura.
+
+    Cada coluna monetária é trocada por uma coluna int64 em centavos
+    ("Valor Líquido" -> ``valor_liquido``) e "Data Emissão" passa a ser
+    datetime64, acompanhada das chaves ``ano``, ``mes`` e ``periodo``.
+    "Tipo", "Classificação" e "UF Emitente" viram categóricas e "Número" é
+    reduzido ao menor inteiro que o comporta.
+    A função é idempotente: o que já foi preparado não é reprocessado.
+    """
+    monetarias = [c for c in colunas_monetarias(df) if nome_coluna(c) not in df.columns]
+    parsear_datas = "Data Emissão" in df.columns and "periodo" not in df.columns
+    categorizar = [
+        c for c in COLUNAS_CATEGORICAS if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype)
+    ]
+    if not monetarias and not parsear_datas and not categorizar:
+        return df
+    novas = {nome_coluna(c): moeda_para_centavos(df[c]) for c in monetarias}
+    novas.update({c: df[c].astype("category") for c in categorizar})
+    novas.update({
+        c: pd.to_numeric(df[c], downcast="integer")
+        for c in COLUNAS_INTEIRAS if c in df.columns and pd.api.types.is_integer_dtype(df[c])
+    })
+    if parsear_datas:
+        datas = datas_para_datetime(df["Data Emissão"])
+        novas["Data Emissão"] = datas
+        novas.update(_chaves_periodo(datas))
+    return df.drop(columns=monetarias).assign(**novas)
+
+
+def _ler_planilha(conteudo, usecols=coluna_do_esquema, leitor=None):
+    """Lê só as abas de notas, na ordem da planilha, marcando a origem na coluna ``aba``.
+
+    Só as colunas do esquema são carregadas (``usecols=None`` lê todas).
+    ``hash_linha`` guarda o hash das células lidas de cada linha e é o
+    que permite detectar, na próxima leitura, quais linhas são novas.
+    O leitor do Excel é escolhido por ``leitores.ler_abas`` (None: o mais
+    rápido disponível); o nome do usado fica em ``df.attrs["leitor"]``.
+    """
+    usado, lidas = ler_abas(conteudo, lambda n: n.strip().lower() in ABAS_NOTAS, usecols, leitor)
+    if not lidas:
+        return pd.DataFrame()
+    nomes, df_list = zip(*lidas)
+    hashes = [pd.util.hash_pandas_object(d, index=False).to_numpy() for d in df_list]
+    df_full = pd.concat(df_list, ignore_index=True)
+    abas = [n.strip().lower() for n in nomes]
+    df_full["aba"] = pd.Categorical.from_codes(
+        np.repeat(np.arange(len(abas)), [len(d) for d in df_list]), categories=abas
+    )
+    df_full["hash_linha"] = np.concatenate(hashes)
+    df_full.attrs["leitor"] = usado
+    return df_full
+
+
+def separar_abas(df):
+    """Devolve ``{"entradas": ..., "saídas": ...}`` como fatias do DataFrame único.
+
+    As abas ficam contíguas após a leitura, então cada uma é um ``iloc`` por
+    faixa de linhas (sem cópia). Se a ordem tiver sido alterada, usa máscara.
+    """
+    vazio = df.iloc[0:0]
+    if "aba" not in df.columns:
+        return {aba: vazio for aba in ABAS_NOTAS}
+    abas = list(df["aba"].cat.categories)
+    codigos = df["aba"].cat.codes.to_numpy()
+    if np.all(codigos[:-1] <= codigos[1:]):
+        limites = np.searchsorted(codigos, np.arange(len(abas) + 1))
+        partes = {aba: df.iloc[limites[i]:limites[i + 1]] for i, aba in enumerate(abas)}
+    else:
+        partes = {aba: df[codigos == i] for i, aba in enumerate(abas)}
+    return {aba: partes.get(aba, vazio) for aba in ABAS_NOTAS}
+
+
+def _inicio_das_novas(antigo, bruto):
+    """Quantas linhas de cada aba já estavam em ``antigo``, se ``bruto`` só acrescentou linhas.
+
+    Devolve ``{aba: n_linhas_antigas}`` quando cada aba de ``antigo`` é um
+    prefixo idêntico (mesmos hashes) da aba correspondente em ``bruto``;
+    qualquer edição, exclusão ou reordenação devolve None.
+    """
+    if "hash_linha" not in antigo.columns or "aba" not in bruto.columns:
+        return None
+    if list(antigo["aba"].cat.categories) != list(bruto["aba"].cat.categories):
+        return None
+    partes_antigas, partes_novas = separar_abas(antigo), separar_abas(bruto)
+    inicio = {}
+    for aba in antigo["aba"].cat.categories:
+        h_antigo = partes_antigas[aba]["hash_linha"].to_numpy()
+        h_novo = partes_novas[aba]["hash_linha"].to_numpy()
+        if len(h_novo) < len(h_antigo) or not np.array_equal(h_antigo, h_novo[:len(h_antigo)]):
+            return None
+        inicio[aba] = len(h_antigo)
+    return inicio
+
+
+def _anexar_linhas(antigo, bruto, inicio):
+    """Prepara só as linhas novas de ``bruto`` e as encaixa ao fim de cada aba de ``antigo``."""
+    partes_antigas, partes_brutas = separar_abas(antigo), separar_abas(bruto)
+    abas = list(antigo["aba"].cat.categories)
+    novas = separar_abas(preparar_notas(
+        pd.concat([partes_brutas[aba].iloc[inicio[aba]:] for aba in abas], ignore_index=True)
+    ))
+    partes = [parte for aba in abas for parte in (partes_antigas[aba], novas[aba])]
+    df = pd.concat(partes, ignore_index=True)
+    # categorias diferentes entre as partes fazem o concat voltar a object
+    for coluna in COLUNAS_CATEGORICAS:
+        if coluna in df.columns and not isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            try:
+                df[coluna] = union_categoricals([parte[coluna] for parte in partes], ignore_order=True)
+            except TypeError:
+                df[coluna] = df[coluna].astype("category")
+    return df
+
+
+def linhas_novas(df, meta):
+    """Linhas acrescentadas na última carga incremental (vazio se ela foi completa)."""
+    delta = (meta or {}).get("delta")
+    if not delta:
+        return df.iloc[0:0]
+    partes = separar_abas(df)
+    return pd.concat(
+        [partes[aba].iloc[n:] for aba, n in delta["inicio"].items()], ignore_index=True
+    )
+
+
+def carregar_notas(path, incremental=True, leitor=None):
+    """Carrega as abas Entradas/Saídas usando o cache colunar ao lado da planilha.
+
+    O cache é reaproveitado enquanto tamanho e mtime não mudarem; se mudarem,
+    o hash do conteúdo decide se é preciso reler o Excel. Quando a planilha
+    só ganhou linhas no fim das abas, apenas essas linhas são preparadas e
+    anexadas ao cache (``meta["delta"]`` registra onde elas começam).
+    ``leitor`` força um leitor de Excel (ver ``leitores.LEITORES``).
+    """
+    path = Path(path)
+    tamanho, mtime_ns = impressao_arquivo(path) or (None, None)
+    if tamanho is None:
+        raise FileNotFoundError(path)
+    dir_cache = pasta_cache(path)
+    meta = ler_meta_cache(path)
+
+    if meta and meta["tamanho"] == tamanho and meta["mtime_ns"] == mtime_ns:
+        try:
+            return abrir_tabela(dir_cache, meta)
+        except Exception as e:
+            logging.warning(f"[cache] Falha ao ler cache de {path}: {e}")
+            meta = None
+
+    conteudo = path.read_bytes()
+    sha256 = hashlib.sha256(conteudo).hexdigest()
+    if meta and meta["sha256"] == sha256:
+        try:
+            df = abrir_tabela(dir_cache, meta)
+            meta.update(tamanho=tamanho, mtime_ns=mtime_ns)
+            try:
+                gravar_json(dir_cache / "meta.json", meta)
+            except OSError:
+                pass
+            return df
+        except Exception as e:
+            logging.warning(f"[cache] Falha ao ler cache de {path}: {e}")
+            meta = None
+
+    bruto = _ler_planilha(conteudo, leitor=leitor)
+    df, delta = None, None
+    if incremental and meta:
+        try:
+            antigo = abrir_tabela(dir_cache, meta)
+            inicio = _inicio_das_novas(antigo, bruto)
+        except Exception as e:
+            logging.warning(f"[cache] Carga incremental indisponível para {path}: {e}")
+            inicio = None
+        if inicio is not None:
+            df = _anexar_linhas(antigo, bruto, inicio)
+            delta = {"de": meta["sha256"], "inicio": inicio}
+            logging.info(f"[cache] {len(df) - len(antigo)} linhas novas anexadas de {path}")
+    if df is None:
+        df = preparar_notas(bruto)
+
+    novo_meta = {
+        "versao": VERSAO_CACHE,
+        "tamanho": tamanho,
+        "mtime_ns": mtime_ns,
+        "sha256": sha256,
+        "delta": delta,
+        "leitor": bruto.attrs.get("leitor"),
+    }
+    try:
+        novo_meta.update(salvar_tabela(dir_cache, "notas", df))
+        gravar_json(dir_cache / "meta.json", novo_meta)
+    except OSError as e:
+        logging.warning(f"[cache] Não foi possível gravar cache de {path}: {e}")
+    return df
@@ -0,0 +1,90 @@
+"""Recalculo incremental a partir de alterações em notas individuais.
+
+Excluir uma nota, corrigir a classificação ou um valor muda poucas células
+do cubo e poucos meses do razão. Em vez de reapurar tudo, as linhas
+alteradas viram um cubo-delta (as versões novas somadas, as antigas
+subtraídas), que é aplicado ao cubo e ao razão já montados; o transporte
+de crédito é refeito só a partir do primeiro mês afetado.
+"""
+import numpy as np
+import pandas as pd
+
+from .apuracao import (
+    ALIQUOTA_PIS_COFINS_PB, COLUNAS_TOTAIS, aplicar_aliquota, aplicar_fechamentos, totais_por_periodo,
+    transportar_razao,
+)
+from .cubo import CHAVES_CUBO, VALORES_CUBO, montar_cubo, somar_cubos
+
+# colunas das notas (já preparadas) que determinam a célula e os valores no cubo
+COLUNAS_DO_CUBO = ["ano", "mes", "Tipo", "Classificação", "UF Emitente", "valor_liquido", "valor_icms"]
+
+
+def linhas_alteradas(originais, ajustadas, excluir=None):
+    """Compara as notas antes e depois dos ajustes (mesmo índice).
+
+    Retorna ``(removidas, incluidas)``: notas com alguma coluna do cubo
+    diferente saem na versão original e entram na ajustada; as marcadas
+    em ``excluir`` (máscara booleana) só saem.
+    """
+    colunas = [c for c in COLUNAS_DO_CUBO if c in originais.columns]
+    antes, depois = originais[colunas], ajustadas.loc[originais.index, colunas]
+    iguais = (antes == depois) | (antes.isna() & depois.isna())
+    mudou = ~iguais.all(axis=1)
+    if excluir is None:
+        excluir = pd.Series(False, index=originais.index)
+    excluir = excluir.reindex(originais.index, fill_value=False).astype(bool)
+    return originais[mudou | excluir], ajustadas.loc[originais.index][mudou & ~excluir]
+
+
+def cubo_do_delta(removidas=None, incluidas=None):
+    """Cubo com as notas incluídas somadas e as removidas subtraídas (contagem de notas inclusive)."""
+    partes = []
+    if incluidas is not None and not incluidas.empty:
+        partes.append(montar_cubo(incluidas))
+    if removidas is not None and not removidas.empty:
+        negativo = montar_cubo(removidas)
+        negativo[VALORES_CUBO + ["notas"]] = -negativo[VALORES_CUBO + ["notas"]]
+        partes.append(negativo)
+    if not partes:
+        return pd.DataFrame(columns=CHAVES_CUBO + VALORES_CUBO + ["notas"])
+    delta = somar_cubos(*partes)
+    alterou = (delta[VALORES_CUBO + ["notas"]] != 0).any(axis=1)
+    return delta[alterou].reset_index(drop=True)
+
+
+def aplicar_delta(cubo, delta):
+    """Cubo depois do ``delta``; células que ficam sem notas são descartadas."""
+    if delta.empty:
+        return cubo
+    novo = somar_cubos(cubo, delta)
+    return novo[novo["notas"] != 0].reset_index(drop=True)
+
+
+def atualizar_razao(razao, delta, fechamentos=None):
+    """Razão depois do ``delta``, retransportado do primeiro mês afetado (ou novo) em diante.
+
+    Só as linhas dos períodos do delta têm os totais refeitos (o PIS/COFINS
+    é recalculado sobre o novo valor líquido do mês, com o mesmo
+    arredondamento da apuração). Com ``fechamentos``, os meses fechados
+    continuam com os valores gravados.
+    """
+    totais = totais_por_periodo(delta) if not delta.empty else pd.DataFrame(columns=COLUNAS_TOTAIS)
+    totais = totais[(totais != 0).any(axis=1)]
+    if totais.empty:
+        return razao
+    periodos = list(razao.index) + list(totais.index)
+    indice = pd.RangeIndex(min(periodos), max(periodos) + 1, name="periodo")
+    # meses novos (antes ou depois do razão) entram zerados, crédito final
+    # inclusive: o transporte tem de passar por eles também
+    novos = indice.difference(razao.index)
+    razao = razao.reindex(indice, fill_value=0)
+    razao["ano"], razao["mes"] = indice // 12, indice % 12 + 1
+
+    afetados = totais.index
+    razao.loc[afetados, COLUNAS_TOTAIS] += totais[COLUNAS_TOTAIS].to_numpy(dtype=np.int64)
+    razao.loc[afetados, "pc_entradas"] = aplicar_aliquota(razao.loc[afetados, "liq_entradas"], ALIQUOTA_PIS_COFINS_PB)
+    razao.loc[afetados, "pc_saidas"] = aplicar_aliquota(razao.loc[afetados, "liq_saidas"], ALIQUOTA_PIS_COFINS_PB)
+    razao = razao.astype(np.int64)
+    if fechamentos:
+        return aplicar_fechamentos(razao, fechamentos)
+    return transportar_razao(razao, desde=min(afetados.min(), novos.min()) if len(novos) else afetados.min())
@@ -0,0 +1,161 @@
+"""Cópia local (espelho) de arquivos que ficam no compartilhamento de rede.
+
+A planilha e o logo moram em ``U:\\``; ler o xlsx pelo SMB a cada carga é
+lento e qualquer instabilidade do compartilhamento vira erro na tela.
+``espelhar`` mantém uma cópia em disco local e devolve o caminho dela:
+
+- a cada chamada só o ``stat`` da origem passa pela rede; tamanho e mtime
+  iguais aos registrados dispensam a cópia;
+- se mudaram, o arquivo é copiado para um temporário e o sha256 decide:
+  conteúdo igual só atualiza o registro (a cópia local e os caches
+  derivados dela continuam valendo), diferente substitui a cópia via rename;
+- se a origem estiver lenta (passou do tempo limite), indisponível ou
+  pela metade (xlsx que não abre como zip), a última cópia boa é servida
+  e a origem só é consultada de novo depois de ``ESPERA_APOS_FALHA``
+  segundos.
+
+Os caches derivados (``.notas_fiscais.cache``, armazém SQLite) ficam ao
+lado da cópia, também em disco local.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+from .dados import gravar_json, ler_json
+
+PASTA_ESPELHO = Path(os.environ.get("LOCALAPPDATA") or Path.home() / ".cache") / "Acompanhamento de empresas" / "espelho"
+# segundos para o stat e para a cópia inteira, respectivamente
+TEMPO_LIMITE_STAT = 3
+TEMPO_LIMITE_COPIA = 120
+ESPERA_APOS_FALHA = 30
+# formatos que são zip por dentro: uma cópia que não abre como zip está pela metade
+SUFIXOS_ZIP = {".xlsx", ".xlsm"}
+
+# uma trava por origem: a cópia da planilha não segura a do logo
+_travas = {}
+_trava_travas = threading.Lock()
+_ultima_falha = {}
+
+
+def _com_tempo_limite(funcao, segundos, *args):
+    """Executa ``funcao`` numa thread daemon e desiste depois de ``segundos``.
+
+    Uma chamada de rede travada não segura a sessão: a thread fica para
+    trás (daemon, não impede o processo de terminar) e sobe TimeoutError.
+    """
+    resultado = {}
+
+    def alvo():
+        try:
+            resultado["valor"] = funcao(*args)
+        except BaseException as e:
+            resultado["erro"] = e
+
+    thread = threading.Thread(target=alvo, daemon=True)
+    thread.start()
+    thread.join(segundos)
+    if thread.is_alive():
+        raise TimeoutError(f"sem resposta em {segundos}s")
+    if "erro" in resultado:
+        raise resultado["erro"]
+    return resultado["valor"]
+
+
+def _stat(origem):
+    st_ = Path(origem).stat()
+    return st_.st_size, st_.st_mtime_ns
+
+
+def _copiar(origem, destino):
+    """Copia ``origem`` para ``destino`` calculando o sha256 no caminho."""
+    sha = hashlib.sha256()
+    with open(origem, "rb") as src, open(destino, "wb") as dst:
+        while bloco := src.read(1 << 20):
+            sha.update(bloco)
+            dst.write(bloco)
+    return sha.hexdigest()
+
+
+def caminho_espelho(origem, pasta=PASTA_ESPELHO):
+    """Onde fica a cópia local de ``origem`` (uma subpasta por caminho de origem)."""
+    origem = Path(origem)
+    chave = hashlib.sha1(str(origem).encode("utf-8")).hexdigest()[:12]
+    return Path(pasta) / f"{origem.parent.name or 'raiz'}-{chave}" / origem.name
+
+
+def _registro(destino):
+    return destino.parent / f".{destino.name}.espelho.json"
+
+
+def _sincronizar(origem, destino):
+    """Atualiza ``destino`` se a origem mudou; sobe OSError/TimeoutError se a origem falhar."""
+    registro = ler_json(_registro(destino)) or {}
+    impressao = _com_tempo_limite(_stat, TEMPO_LIMITE_STAT, origem)
+    if destino.exists() and [registro.get("tamanho"), registro.get("mtime_ns")] == list(impressao):
+        return
+
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=destino.parent, prefix=f".{destino.name}.", suffix=".tmp")
+    os.close(fd)
+    tmp = Path(tmp)
+    try:
+        sha256 = _com_tempo_limite(_copiar, TEMPO_LIMITE_COPIA, origem, tmp)
+        if _com_tempo_limite(_stat, TEMPO_LIMITE_STAT, origem) != impressao:
+            # a planilha estava sendo salva durante a cópia; fica para a próxima
+            raise OSError("a origem mudou durante a cópia")
+        if destino.suffix.lower() in SUFIXOS_ZIP and not zipfile.is_zipfile(tmp):
+            raise OSError("a origem está incompleta (sendo gravada?)")
+        if destino.exists() and registro.get("sha256") == sha256:
+            logging.info(f"[espelho] {origem} com nova data, mesmo conteúdo; cópia local mantida")
+        else:
+            os.utime(tmp, ns=(impressao[1], impressao[1]))
+            tmp.replace(destino)
+            logging.info(f"[espelho] {origem} copiado para {destino}")
+        gravar_json(_registro(destino), {
+            "origem": str(origem), "tamanho": impressao[0], "mtime_ns": impressao[1], "sha256": sha256,
+        })
+    finally:
+        try:
+            tmp.unlink(missing_ok=True)
+        except OSError:
+            pass  # ainda aberto pela thread que estourou o tempo
+
+
+def _trava_da_origem(origem):
+    with _trava_travas:
+        return _travas.setdefault(origem, threading.Lock())
+
+
+def espelhar(origem, pasta=PASTA_ESPELHO):
+    """Caminho local atualizado de ``origem``; a última cópia boa se a origem falhar.
+
+    Se outra sessão já está sincronizando a mesma origem, devolve na hora a
+    cópia existente em vez de esperar; só quem ainda não tem cópia espera.
+    Sobe o erro da origem só quando ainda não existe nenhuma cópia local.
+    """
+    origem = Path(origem)
+    destino = caminho_espelho(origem, pasta)
+    falhou_em = _ultima_falha.get(origem)
+    if falhou_em is not None and destino.exists() and time.monotonic() - falhou_em < ESPERA_APOS_FALHA:
+        return destino
+    trava = _trava_da_origem(origem)
+    if not trava.acquire(blocking=False):
+        if destino.exists():
+            return destino
+        trava.acquire()
+    try:
+        _sincronizar(origem, destino)
+        _ultima_falha.pop(origem, None)
+    except OSError as e:
+        _ultima_falha[origem] = time.monotonic()
+        if not destino.exists():
+            raise
+        logging.warning(f"[espelho] {origem} indisponível ({e}); usando a cópia local de {destino}")
+    finally:
+        trava.release()
+    return destino
@@ -0,0 +1,202 @@
+"""Fechamentos mensais: meses entregues ao fisco ficam congelados.
+
+Cada fechamento grava a linha do razão do mês (centavos int64) e a
+impressão digital das notas que a geraram em ``<planilha>.fechamentos.json``,
+ao lado da planilha. Os relatórios reaproveitam os meses fechados e só
+apuram os abertos; se as notas de um mês fechado mudarem depois, o mês
+continua com os valores gravados e ``divergencias`` aponta a diferença.
+Reabrir e fechar de novo cria uma nova versão; as anteriores ficam no histórico.
+
+Arquivo ausente é "nenhum mês fechado"; arquivo ilegível (compartilhamento
+fora do ar, JSON corrompido) sobe ``FechamentosIlegiveis`` e nunca é
+regravado. As gravações passam por uma trava (``<arquivo>.trava``, criada
+de forma exclusiva) e releem o histórico dentro dela, então duas sessões
+fechando meses diferentes ao mesmo tempo não perdem nenhum dos dois.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from .apuracao import COLUNAS_RAZAO
+from .cubo import CHAVES_CUBO, VALORES_CUBO
+from .dados import gravar_json
+
+VERSAO_FECHAMENTOS = 1
+# segundos esperando a trava de outra sessão; trava mais velha que isso é abandonada
+ESPERA_TRAVA = 10
+TRAVA_VENCIDA = 60
+
+# última leitura boa de cada arquivo, servida quando ele fica ilegível
+_ultimos_lidos = {}
+
+
+class FechamentosIlegiveis(OSError):
+    """O arquivo de fechamentos existe (ou pode existir) mas não pôde ser lido."""
+
+
+def arquivo_fechamentos(path):
+    path = Path(path)
+    return path.parent / f"{path.stem}.fechamentos.json"
+
+
+def _chave_mes(ano, mes):
+    return f"{ano}-{mes:02d}"
+
+
+def _periodo_da_chave(chave):
+    ano, mes = map(int, chave.split("-"))
+    return ano * 12 + mes - 1
+
+
+def ler_historico(path):
+    """Todos os registros gravados: ``{"AAAA-MM": [versão 1, versão 2, ...]}``.
+
+    ``{}`` só quando o arquivo não existe numa pasta acessível; qualquer
+    outra falha de leitura sobe ``FechamentosIlegiveis``.
+    """
+    arquivo = arquivo_fechamentos(path)
+    try:
+        dados = json.loads(arquivo.read_text(encoding="utf-8"))
+    except FileNotFoundError as e:
+        if arquivo.parent.is_dir():
+            return {}
+        raise FechamentosIlegiveis(f"pasta de {arquivo} inacessível") from e
+    except (OSError, ValueError) as e:
+        raise FechamentosIlegiveis(f"{arquivo} ilegível: {e}") from e
+    if not isinstance(dados, dict) or dados.get("versao") != VERSAO_FECHAMENTOS:
+        versao = dados.get("versao") if isinstance(dados, dict) else None
+        raise FechamentosIlegiveis(f"formato {versao} desconhecido em {arquivo}")
+    return dados.get("meses", {})
+
+
+@contextmanager
+def _travado(path):
+    """Trava exclusiva do arquivo de fechamentos entre sessões (e máquinas)."""
+    trava = arquivo_fechamentos(path).with_suffix(".trava")
+    limite = time.monotonic() + ESPERA_TRAVA
+    while True:
+        try:
+            fd = os.open(trava, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - trava.stat().st_mtime > TRAVA_VENCIDA:
+                    logging.warning(f"[fechamento] Trava abandonada removida: {trava}")
+                    trava.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > limite:
+                raise TimeoutError(f"fechamentos em uso por outra sessão ({trava})")
+            time.sleep(0.1)
+    try:
+        try:
+            os.write(fd, f"{os.getpid()} {datetime.now().isoformat(timespec='seconds')}".encode("utf-8"))
+        finally:
+            os.close(fd)
+        yield
+    finally:
+        trava.unlink(missing_ok=True)
+
+
+def _gravar_historico(path, historico):
+    gravar_json(arquivo_fechamentos(path), {"versao": VERSAO_FECHAMENTOS, "meses": historico})
+
+
+def fechamentos_ativos(path):
+    """``{periodo: registro}`` dos meses fechados (última versão, não reaberta).
+
+    Sobe ``FechamentosIlegiveis`` se o arquivo não puder ser lido; a última
+    leitura boa continua disponível em ``ultimos_fechamentos``.
+    """
+    ativos = {
+        _periodo_da_chave(chave): versoes[-1]
+        for chave, versoes in ler_historico(path).items()
+        if versoes and not versoes[-1].get("reaberto_em")
+    }
+    _ultimos_lidos[arquivo_fechamentos(path)] = ativos
+    return ativos
+
+
+def ultimos_fechamentos(path):
+    """Última leitura boa de ``fechamentos_ativos(path)`` neste processo (None se nunca houve)."""
+    return _ultimos_lidos.get(arquivo_fechamentos(path))
+
+
+def assinatura_fechamentos(fechamentos):
+    """Tupla hasheável que muda a cada fechamento ou reabertura (chave de caches)."""
+    return tuple(sorted((periodo, registro["versao"]) for periodo, registro in (fechamentos or {}).items()))
+
+
+def impressoes_por_periodo(cubo):
+    """Impressão digital (sha1) das linhas do cubo de cada período.
+
+    Usa as chaves, os valores em centavos e a contagem de notas, em forma
+    canônica: o cubo da planilha e o do armazém SQL dão a mesma impressão.
+    """
+    if cubo is None or cubo.empty:
+        return {}
+    base = cubo[cubo["ano"] > 0]
+    periodos = base["ano"].astype(np.int64) * 12 + base["mes"].astype(np.int64) - 1
+    chaves = base[CHAVES_CUBO].astype("string").fillna("")
+    valores = base[VALORES_CUBO + ["notas"]].astype(np.int64)
+    linhas = sorted(zip(periodos.tolist(), chaves.values.tolist(), valores.values.tolist()))
+    impressoes, atual, partes = {}, None, []
+    for periodo, chave, valor in linhas + [(None, None, None)]:
+        if periodo != atual:
+            if atual is not None:
+                impressoes[atual] = hashlib.sha1(json.dumps(partes).encode("utf-8")).hexdigest()
+            atual, partes = periodo, []
+        partes.append([chave, valor])
+    return impressoes
+
+
+def fechar_mes(path, ano, mes, razao, cubo):
+    """Fecha ``mes``/``ano`` gravando a linha do ``razao`` (já com os fechamentos aplicados)."""
+    periodo = ano * 12 + mes - 1
+    if periodo not in razao.index:
+        raise ValueError(f"{_chave_mes(ano, mes)} fora do período das notas")
+    linha = razao.loc[periodo]
+    with _travado(path):
+        historico = ler_historico(path)
+        versoes = historico.setdefault(_chave_mes(ano, mes), [])
+        if versoes and not versoes[-1].get("reaberto_em"):
+            raise ValueError(f"{_chave_mes(ano, mes)} já está fechado")
+        registro = {
+            "versao": len(versoes) + 1,
+            "fechado_em": datetime.now().isoformat(timespec="seconds"),
+            "impressao": impressoes_por_periodo(cubo).get(periodo, ""),
+            "razao": {coluna: int(linha[coluna]) for coluna in COLUNAS_RAZAO if coluna not in ("ano", "mes")},
+        }
+        versoes.append(registro)
+        _gravar_historico(path, historico)
+    logging.info(f"[fechamento] {_chave_mes(ano, mes)} fechado (versão {registro['versao']})")
+    return registro
+
+
+def reabrir_mes(path, ano, mes):
+    with _travado(path):
+        historico = ler_historico(path)
+        versoes = historico.get(_chave_mes(ano, mes))
+        if not versoes or versoes[-1].get("reaberto_em"):
+            raise ValueError(f"{_chave_mes(ano, mes)} não está fechado")
+        versoes[-1]["reaberto_em"] = datetime.now().isoformat(timespec="seconds")
+        _gravar_historico(path, historico)
+    logging.info(f"[fechamento] {_chave_mes(ano, mes)} reaberto")
+
+
+def divergencias(fechamentos, cubo):
+    """Meses fechados cujas notas mudaram desde o fechamento: ``[(ano, mes), ...]``."""
+    impressoes = impressoes_por_periodo(cubo)
+    return [
+        (periodo // 12, periodo % 12 + 1)
+        for periodo, registro in sorted((fechamentos or {}).items())
+        if impressoes.get(periodo, "") != registro["impressao"]
+    ]
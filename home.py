@@ -1,4 +1,5 @@
 import sys
+import logging
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
@@ -6,14 +7,51 @@ import streamlit as st
 import pandas as pd
 
 from app.meses import MESES_PT, MES_PARA_NUM
+from app.dados import carregar_notas, impressao_arquivo, separar_abas
+from app.espelho import caminho_espelho, espelhar
+from app.vigia import aguardar_pacote, apuracao_pronta, iniciar_vigia, pacote_atual
+from app.cubo import cubo_da_planilha
+from app.razao import razao_da_planilha
+from app.apuracao import aplicar_fechamentos
+from app.fechamento import FechamentosIlegiveis, assinatura_fechamentos, fechamentos_ativos, ultimos_fechamentos
+from app.armazem import consultar_cubo, sincronizar_armazem
 
-from app.relatorio_fiscal import calcular_resumo_fiscal_mes_a_mes, gerar_excel_resumo
+from app.relatorio_fiscal import calcular_resumo_fiscal_mes_a_mes, botao_download_resumo
 from app.relatorio_fiscal import simulador_icms_manual, simulador_pis_cofins_manual  # <-- Adicione aqui
+from app.relatorio_fiscal import simulador_ajustes_notas
+from app.relatorio_fiscal import mostrar_apuracao_empresas, avisar_divergencias, controle_fechamento
 from app.relatorio_contabil import mostrar_resumo_contabil
 from app.relatorio_graficos import mostrar_dashboard
 
 DATA_PATH = Path(r"U:\Automações PYTHON\Acompanhamento de empresas\data\notas_fiscais.xlsx")
 LOGO_PATH = Path(r"U:\Automações PYTHON\Acompanhamento de empresas\assets\logo.png")
+# Uma pasta por empresa, cada uma com sua notas_fiscais.xlsx (modo multiempresa)
+EMPRESAS_PATH = Path(r"U:\Automações PYTHON\Acompanhamento de empresas\empresas")
+# True: as notas ficam num SQLite indexado ao lado da planilha e só os
+# agregados (calculados no banco) são carregados na memória
+USAR_ARMAZEM_SQL = False
+# Leitor do Excel ("calamine", "openpyxl" ou "pandas"); None usa o mais rápido
+# instalado, caindo para o seguinte se falhar (ver app.leitores)
+LEITOR_EXCEL = None
+# True: planilha e logo são lidos de uma cópia local (app.espelho), atualizada
+# só quando mudam no compartilhamento; se o U:\ cair, a última cópia é usada
+USAR_ESPELHO_LOCAL = True
+# True: uma thread em segundo plano (app.vigia) prepara notas, cubo, razão e a
+# apuração do ano corrente assim que a planilha muda, antes da próxima sessão
+USAR_VIGIA = True
+
+# Log detalhado da interface; o núcleo de cálculo (app.apuracao) não configura logging
+LOG_PATH = Path(__file__).resolve().parent / "reports" / "relatorio_fiscal_debug.log"
+LOG_PATH.parent.mkdir(exist_ok=True)
+logging.basicConfig(
+    filename=str(LOG_PATH),
+    level=logging.DEBUG,
+    format='%(asctime)s | %(levelname)s | %(message)s',
+    filemode='a'
+)
+# Copy-on-write: filtros e colunas derivadas compartilham a memória das notas
+# até serem modificados, e ninguém altera sem querer o DataFrame compartilhado
+pd.set_option("mode.copy_on_write", True)
 
 st.set_page_config(page_title="Acompanhamento de Empresas", layout="wide")
 
@@ -115,39 +153,87 @@ st.markdown(
 
 # ===== SIDEBAR (MENU LATERAL) =====
 with st.sidebar:
-    if LOGO_PATH.exists():
-        st.image(str(LOGO_PATH), width=200)
+    try:
+        logo = espelhar(LOGO_PATH) if USAR_ESPELHO_LOCAL else LOGO_PATH
+    except OSError:
+        logo = None
+    if logo is not None and logo.exists():
+        st.image(str(logo), width=200)
     st.markdown("<h4 style='text-align:center; color:#cead43;'>Neto Contabilidade</h4>", unsafe_allow_html=True)
     st.markdown("---")
     st.markdown("#### Filtros de Período")
+    @st.cache_resource
+    def vigia_de_fundo():
+        # uma thread por processo, compartilhada por todas as sessões
+        return iniciar_vigia(DATA_PATH, EMPRESAS_PATH, leitor=LEITOR_EXCEL, usar_espelho=USAR_ESPELHO_LOCAL)
+
+    @st.cache_resource(max_entries=2)
+    def carregar_df_unico(path, versao):
+        # ``versao`` (tamanho, mtime) invalida o cache quando a planilha muda;
+        # uma só cópia das notas, somente leitura, para todas as sessões
+        return carregar_notas(path, leitor=LEITOR_EXCEL)
+
+    @st.cache_data
+    def carregar_cubo(path, versao, _df):
+        # o DataFrame não é hasheado; a versão dos dados identifica o cubo
+        return cubo_da_planilha(path, _df)
+
     @st.cache_data
-    def carregar_df_unico(path):
-        all_sheets = pd.read_excel(path, sheet_name=None)
-        df_list = [
-            df for name, df in all_sheets.items()
-            if name.strip().lower() in ["entradas", "saídas"]
-        ]
-        if not df_list:
-            return pd.DataFrame()
-        df_full = pd.concat(df_list, ignore_index=True)
-        return df_full
+    def carregar_razao(path, versao, _cubo):
+        # razão de créditos de todos os anos, a partir do cubo completo
+        return razao_da_planilha(path, _cubo)
 
     @st.cache_data
-    def get_periodos(df):
-        if "Data Emissão" not in df.columns:
-            return [], [], []
-        datas = pd.to_datetime(df["Data Emissão"], format="%d/%m/%Y", errors='coerce')
-        anos = sorted(datas.dt.year.dropna().unique().astype(int).tolist())
-        meses = sorted(datas.dt.month.dropna().unique().astype(int).tolist())
-        return anos, meses, datas
+    def carregar_cubo_armazem(path, versao, ano=None):
+        # agregação e filtro de ano executados no SQLite
+        return consultar_cubo(sincronizar_armazem(path), ano)
+
+    def get_periodos(cubo):
+        # ano/mes já vêm calculados em preparar_notas; 0 marca data inválida
+        validas = cubo["ano"] > 0
+        anos = sorted(cubo.loc[validas, "ano"].unique().astype(int).tolist())
+        meses = sorted(cubo.loc[validas, "mes"].unique().astype(int).tolist())
+        return anos, meses
 
+    # notas, cubo e razão vêm da cópia local; os fechamentos continuam no
+    # compartilhamento (DATA_PATH), que é onde os outros usuários os gravam
+    pacote = None
+    if USAR_VIGIA and not USAR_ARMAZEM_SQL:
+        vigia_de_fundo()
+        pacote = pacote_atual(DATA_PATH)
+        if pacote is None:
+            with st.spinner("Preparando os dados da planilha..."):
+                pacote = aguardar_pacote(DATA_PATH)
+    if pacote is not None:
+        # o vigia é quem sincroniza a cópia local: a sessão usa a versão que ele publicou
+        dados_path, versao_dados = pacote["path"], pacote["versao"]
+    else:
+        if USAR_VIGIA and not USAR_ARMAZEM_SQL:
+            # vigia ainda sem pacote: última cópia local como está, sem sincronizar
+            copia = caminho_espelho(DATA_PATH)
+            dados_path = copia if USAR_ESPELHO_LOCAL and copia.exists() else DATA_PATH
+        else:
+            try:
+                dados_path = espelhar(DATA_PATH) if USAR_ESPELHO_LOCAL else DATA_PATH
+            except OSError as e:
+                logging.error(f"[espelho] Sem cópia local de {DATA_PATH}: {e}")
+                dados_path = DATA_PATH
+        versao_dados = impressao_arquivo(dados_path)
     try:
-        df = carregar_df_unico(DATA_PATH)
-        anos, meses, datas = get_periodos(df)
+        if USAR_ARMAZEM_SQL:
+            df = pd.DataFrame()
+            cubo = carregar_cubo_armazem(dados_path, versao_dados)
+        elif pacote is not None:
+            df, cubo = pacote["df"], pacote["cubo"]
+        else:
+            df = carregar_df_unico(dados_path, versao_dados)
+            cubo = carregar_cubo(dados_path, versao_dados, df)
+        anos, meses = get_periodos(cubo)
     except Exception as e:
         st.error(f"Erro ao carregar a planilha: {e}")
         df = pd.DataFrame()
-        anos, meses, datas = [], [], []
+        cubo = None
+        anos, meses = [], []
 
     ano_sel = st.selectbox(
         "Ano",
@@ -188,7 +274,9 @@ with st.sidebar:
     relatorio_fiscal_opcoes = [
         "Apuração de Tributos Fiscais",
         "Simulação Manual de ICMS",
-        "Simulação Manual de PIS/COFINS"   # <-- Aqui!
+        "Simulação Manual de PIS/COFINS",   # <-- Aqui!
+        "Simulação de Ajustes nas Notas",
+        "Apuração Consolidada (Empresas)",
     ]
     relatorio_contabil_opcoes = ["DRE", "Balanço Patrimonial"]
     relatorio_dash_opcoes = ["Resumo Gráfico", "Indicadores"]
@@ -225,11 +313,40 @@ with st.sidebar:
             key="rel_dash"
         )
 
+# Cubo do ano selecionado; no modo SQL o filtro de ano é resolvido pelo banco
+cubo_ano = cubo
+if USAR_ARMAZEM_SQL and cubo is not None:
+    cubo_ano = carregar_cubo_armazem(dados_path, versao_dados, ano_sel)
+# Créditos transportados entre anos: saldo de abertura lido do razão, com os
+# meses já fechados congelados nos valores gravados
+try:
+    fechamentos = fechamentos_ativos(DATA_PATH)
+except FechamentosIlegiveis as e:
+    # nunca tratar como "nenhum mês fechado": isso reapuraria meses já entregues
+    fechamentos = ultimos_fechamentos(DATA_PATH)
+    if fechamentos is None:
+        st.error(
+            f"Não foi possível ler os fechamentos ({e}). A apuração não é exibida "
+            "para não recalcular meses já fechados; tente de novo em instantes."
+        )
+        st.stop()
+    st.warning(f"Não foi possível ler os fechamentos ({e}); exibindo os da última leitura.")
+versao_fechamentos = assinatura_fechamentos(fechamentos)
+razao = None
+if cubo is not None:
+    razao_base = pacote["razao"] if pacote is not None else carregar_razao(dados_path, versao_dados, cubo)
+    razao = aplicar_fechamentos(razao_base, fechamentos)
+
 st.title("Apuração Fiscal")
 
 # --------- APURAÇÃO DO PERÍODO VIGENTE -----------
 if tipo_relatorio == "📁 Fiscal" and relatorio_escolhido == "Apuração de Tributos Fiscais":
-    resumo_mensal_full = calcular_resumo_fiscal_mes_a_mes(df, ano_sel, meses_sel)
+    avisar_divergencias(fechamentos, cubo, versao_dados, versao_fechamentos)
+    resumo_mensal_full = apuracao_pronta(pacote, ano_sel, meses_sel, versao_fechamentos)
+    if resumo_mensal_full is None:
+        resumo_mensal_full = calcular_resumo_fiscal_mes_a_mes(
+            df, ano_sel, meses_sel, cubo=cubo_ano, razao=razao, fechamentos=fechamentos
+        )
     if resumo_mensal_full and isinstance(resumo_mensal_full, list):
         ultimo = resumo_mensal_full[-1]
         mes_vigente = ultimo.get("Mês", "-")
@@ -279,7 +396,7 @@ if tipo_relatorio == "📁 Fiscal":
             for linha in resumo_mensal:
                 with st.expander(
                     f"{linha['Mês']} {linha['Ano']}",
-                    expanded=(linha['Mês'] == MESES_PT[datas.dt.month.min()]),
+                    expanded=bool(meses) and linha['Mês'] == MESES_PT[meses[0]],
                 ):
                     st.markdown(
                         "<div class='titulo-apuracao'>APURAÇÃO ICMS</div>",
@@ -299,23 +416,23 @@ if tipo_relatorio == "📁 Fiscal":
                     d4.markdown(f"<div class='card red'>PIS/COFINS A PAGAR<br><b>{format_brl(linha['PIS/COFINS a Pagar'])}</b></div>", unsafe_allow_html=True)
 
                     st.markdown(" ")
-                    df_mes = pd.DataFrame([linha])
-                    excel_mes = gerar_excel_resumo([linha])
-                    st.download_button(
-                        label=f"Baixar planilha deste mês ({linha['Mês']})",
-                        data=excel_mes,
-                        file_name=f"resumo_fiscal_{linha['Ano']}_{linha['Mês']}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    controle_fechamento(DATA_PATH, linha["Ano"], MES_PARA_NUM[linha["Mês"]], fechamentos, razao, cubo)
+                    # xlsx gerado só no clique, memorizado por (versão dos dados, período)
+                    botao_download_resumo(
+                        f"Baixar planilha deste mês ({linha['Mês']})",
+                        [linha],
+                        f"resumo_fiscal_{linha['Ano']}_{linha['Mês']}.xlsx",
+                        versao=versao_dados,
+                        chave=(ano_sel, tuple(meses_sel), linha["Mês"], versao_fechamentos),
                     )
             st.markdown("---")
             st.subheader("Baixar Tabela Detalhada (todos os meses selecionados)")
-            df_todos = pd.DataFrame(resumo_mensal)
-            excel_all = gerar_excel_resumo(resumo_mensal)
-            st.download_button(
-                label="📥 Baixar planilha detalhada (.xlsx)",
-                data=excel_all,
-                file_name="resumo_fiscal_mes_a_mes.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            botao_download_resumo(
+                "📥 Baixar planilha detalhada (.xlsx)",
+                resumo_mensal,
+                "resumo_fiscal_mes_a_mes.xlsx",
+                versao=versao_dados,
+                chave=(ano_sel, tuple(meses_sel), "todos", versao_fechamentos),
             )
         else:
             st.info("Nenhum dado fiscal disponível.")
@@ -323,17 +440,24 @@ if tipo_relatorio == "📁 Fiscal":
         st.info("Mapa por UF: (implementação futura)")
     elif relatorio_escolhido == "Simulação Manual de ICMS":
         # --------- SIMULAÇÃO MANUAL DE ICMS -----------
-        simulador_icms_manual(df=df, ano_sel=ano_sel, meses_sel=meses_sel)
+        simulador_icms_manual(df=cubo, ano_sel=ano_sel, meses_sel=meses_sel, versao=versao_dados, notas=df, razao=razao)
     elif relatorio_escolhido == "Simulação Manual de PIS/COFINS":
         # Simulador PIS/COFINS - NOVA FUNÇÃO
-        simulador_pis_cofins_manual(df, ano_sel, meses_sel)
+        simulador_pis_cofins_manual(cubo, ano_sel, meses_sel, versao=versao_dados, notas=df, razao=razao)
+    elif relatorio_escolhido == "Simulação de Ajustes nas Notas":
+        simulador_ajustes_notas(df, cubo, razao, ano_sel, meses_sel, fechamentos)
+    elif relatorio_escolhido == "Apuração Consolidada (Empresas)":
+        mostrar_apuracao_empresas(EMPRESAS_PATH, ano_sel, meses_sel)
 elif tipo_relatorio == "📊 Contábil":
     st.info(f"Relatório selecionado: {relatorio_escolhido} (implementação futura)")
 elif tipo_relatorio == "📈 Dashboards":
-    # Carrega as abas separadas
-    entradas = pd.read_excel(DATA_PATH, sheet_name="Entradas")
-    saidas = pd.read_excel(DATA_PATH, sheet_name="Saídas")
-    mostrar_dashboard(entradas, saidas, [ano_sel], meses_sel)
+    if cubo is None:
+        st.info("Nenhum dado disponível.")
+    else:
+        # Abas separadas como fatias do DataFrame já carregado (sem reler a planilha)
+        abas = separar_abas(df)
+        mostrar_dashboard(abas["entradas"], abas["saídas"], [ano_sel], meses_sel, cubo=cubo_ano, razao=razao,
+                          fechamentos=fechamentos)
 else:
     st.info("Nenhum relatório configurado ainda. Selecione um tipo acima para iniciar.")
 
@@ -0,0 +1,164 @@
+"""Leitores de planilha intercambiáveis para as abas de notas.
+
+Cada leitor recebe o conteúdo do xlsx (bytes), um filtro de nomes de aba e
+o ``usecols`` do esquema, e devolve ``[(aba, DataFrame), ...]`` na ordem da
+planilha. ``ler_abas`` tenta os leitores na ordem de ``ORDEM_LEITORES``
+(o mais rápido disponível primeiro) e cai para o seguinte se um deles não
+estiver instalado ou falhar; o último é o ``pd.ExcelFile`` de sempre.
+
+Desempenho de cada leitor numa planilha real::
+
+    python -m app.leitores "U:\\...\\data\\notas_fiscais.xlsx" --saida bench_output.txt
+"""
+import argparse
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+import pandas as pd
+
+
+def _em_paralelo(funcao, itens):
+    """``map`` com uma thread por item (as abas são poucas)."""
+    if len(itens) < 2:
+        return [funcao(item) for item in itens]
+    with ThreadPoolExecutor(max_workers=len(itens)) as executor:
+        return list(executor.map(funcao, itens))
+
+
+def _ler_com_pandas(conteudo, filtro, usecols, engine=None, paralelo=False):
+    with pd.ExcelFile(BytesIO(conteudo), engine=engine) as xls:
+        nomes = [n for n in xls.sheet_names if filtro(n)]
+        if not paralelo or len(nomes) < 2:
+            return [(n, xls.parse(n, usecols=usecols)) for n in nomes]
+
+    def ler(nome):
+        # um arquivo aberto por thread: os objetos do leitor não são compartilháveis
+        with pd.ExcelFile(BytesIO(conteudo), engine=engine) as xls:
+            return xls.parse(nome, usecols=usecols)
+
+    return list(zip(nomes, _em_paralelo(ler, nomes)))
+
+
+def ler_calamine(conteudo, filtro, usecols=None):
+    """Leitor em Rust (python-calamine): libera o GIL, então as abas são lidas em paralelo."""
+    import python_calamine  # noqa: F401 — ImportError passa para o próximo leitor
+    return _ler_com_pandas(conteudo, filtro, usecols, engine="calamine", paralelo=True)
+
+
+def _aba_openpyxl(conteudo, nome, usecols):
+    from openpyxl import load_workbook
+    wb = load_workbook(BytesIO(conteudo), read_only=True, data_only=True)
+    try:
+        linhas = wb[nome].iter_rows(values_only=True)
+        cabecalho = next(linhas, None) or ()
+        indices = [i for i, c in enumerate(cabecalho) if c is not None and (usecols is None or usecols(c))]
+        dados = [[linha[i] if i < len(linha) else None for i in indices] for linha in linhas]
+    finally:
+        wb.close()
+    while dados and all(v is None for v in dados[-1]):
+        dados.pop()
+    return pd.DataFrame(dados, columns=[str(cabecalho[i]) for i in indices])
+
+
+def ler_openpyxl(conteudo, filtro, usecols=None):
+    """openpyxl em modo somente leitura: percorre as linhas sem montar a planilha inteira."""
+    from openpyxl import load_workbook
+    wb = load_workbook(BytesIO(conteudo), read_only=True, data_only=True)
+    try:
+        nomes = [n for n in wb.sheetnames if filtro(n)]
+    finally:
+        wb.close()
+    return list(zip(nomes, _em_paralelo(lambda nome: _aba_openpyxl(conteudo, nome, usecols), nomes)))
+
+
+def ler_pandas(conteudo, filtro, usecols=None):
+    """``pd.ExcelFile`` com o engine padrão — o leitor original, sempre disponível."""
+    return _ler_com_pandas(conteudo, filtro, usecols)
+
+
+LEITORES = {
+    "calamine": ler_calamine,
+    "openpyxl": ler_openpyxl,
+    "pandas": ler_pandas,
+}
+ORDEM_LEITORES = ["calamine", "openpyxl", "pandas"]
+
+
+def ler_abas(conteudo, filtro, usecols=None, leitor=None):
+    """Lê as abas aceitas por ``filtro(nome)`` com o primeiro leitor que funcionar.
+
+    ``leitor`` força um leitor (com queda para ``"pandas"`` se falhar).
+    Retorna ``(nome_do_leitor, [(aba, DataFrame), ...])``.
+    """
+    candidatos = list(dict.fromkeys([leitor, "pandas"] if leitor else ORDEM_LEITORES))
+    erro = None
+    for nome in candidatos:
+        try:
+            return nome, LEITORES[nome](conteudo, filtro, usecols)
+        except ImportError as e:
+            logging.debug(f"[leitura] Leitor {nome} indisponível: {e}")
+            erro = e
+        except Exception as e:
+            logging.warning(f"[leitura] Leitor {nome} falhou ({e}); tentando o próximo")
+            erro = e
+    raise erro
+
+
+def medir_leitores(path, filtro=lambda nome: True, usecols=None, repeticoes=3):
+    """Tempo (melhor de ``repeticoes``) e vazão de cada leitor sobre a planilha ``path``."""
+    conteudo = Path(path).read_bytes()
+    resultados = []
+    for nome in ORDEM_LEITORES:
+        tempos, linhas, erro = [], 0, None
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            try:
+                abas = LEITORES[nome](conteudo, filtro, usecols)
+            except Exception as e:
+                erro = f"{type(e).__name__}: {e}"
+                break
+            tempos.append(time.perf_counter() - inicio)
+            linhas = sum(len(df) for _, df in abas)
+        segundos = min(tempos) if tempos else None
+        resultados.append({
+            "leitor": nome,
+            "segundos": segundos,
+            "linhas": linhas,
+            "linhas/s": linhas / segundos if segundos else None,
+            "MB/s": len(conteudo) / 1e6 / segundos if segundos else None,
+            "erro": erro or "-",
+        })
+    return pd.DataFrame(resultados)
+
+
+def main(argv=None):
+    from .dados import ABAS_NOTAS, coluna_do_esquema
+
+    parser = argparse.ArgumentParser(prog="python -m app.leitores", description="Compara os leitores de planilha.")
+    parser.add_argument("planilha")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--todas-colunas", action="store_true", help="ignorar o esquema e ler todas as colunas")
+    parser.add_argument("--saida", help="grava a tabela de resultados também neste arquivo")
+    args = parser.parse_args(argv)
+
+    tabela = medir_leitores(
+        args.planilha,
+        filtro=lambda nome: nome.strip().lower() in ABAS_NOTAS,
+        usecols=None if args.todas_colunas else coluna_do_esquema,
+        repeticoes=args.repeticoes,
+    )
+    texto = f"{args.planilha} ({Path(args.planilha).stat().st_size / 1e6:.1f} MB)\n" + tabela.to_string(
+        index=False, float_format=lambda v: f"{v:,.2f}", na_rep="-"
+    )
+    print(texto)
+    if args.saida:
+        Path(args.saida).write_text(texto + "\n", encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
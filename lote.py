@@ -0,0 +1,106 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from .apuracao import calcular_resumo_fiscal_mes_a_mes
+from .cubo import cubo_da_planilha
+from .dados import carregar_notas, impressao_arquivo
+from .fechamento import arquivo_fechamentos, divergencias, fechamentos_ativos
+from .razao import razao_da_planilha
+
+NOME_PLANILHA = "notas_fiscais.xlsx"
+
+
+def nome_empresa(path, raiz):
+    """Nome da empresa = pasta da planilha relativa à raiz (ignorando uma subpasta ``data``)."""
+    pasta = Path(path).parent
+    if pasta.name.lower() == "data" and pasta != Path(raiz):
+        pasta = pasta.parent
+    try:
+        relativo = pasta.relative_to(raiz)
+    except ValueError:
+        return pasta.name
+    return relativo.as_posix() if relativo.parts else Path(raiz).name
+
+
+def descobrir_empresas(raiz, nome=NOME_PLANILHA):
+    """Procura as planilhas de notas das empresas sob ``raiz``.
+
+    Retorna ``{empresa: caminho}`` em ordem alfabética; pastas ocultas
+    (como os caches ``.notas_fiscais.cache``) são ignoradas.
+    """
+    raiz = Path(raiz)
+    empresas = {}
+    for path in sorted(raiz.rglob(nome)):
+        if any(p.startswith(".") for p in path.relative_to(raiz).parts[:-1]):
+            continue
+        empresa = nome_empresa(path, raiz)
+        if empresa in empresas:
+            logging.warning(f"[lote] Empresa {empresa} com mais de uma planilha; usando {empresas[empresa]}")
+            continue
+        empresas[empresa] = path
+    return empresas
+
+
+def apurar_empresa(empresa, path, ano, meses, considerar_acumulo_previos=True):
+    """Apuração de uma empresa; roda dentro do processo trabalhador.
+
+    Devolve ``(empresa, linhas, erro)`` — só listas de dicionários atravessam
+    o limite entre processos, nunca as notas.
+    """
+    try:
+        df = carregar_notas(path)
+        cubo = cubo_da_planilha(path, df)
+        fechamentos = fechamentos_ativos(path)
+        for ano_f, mes_f in divergencias(fechamentos, cubo):
+            logging.warning(f"[lote] {empresa}: notas de {mes_f:02d}/{ano_f} mudaram depois do fechamento")
+        linhas = calcular_resumo_fiscal_mes_a_mes(
+            df, ano, meses, considerar_acumulo_previos, cubo=cubo, razao=razao_da_planilha(path, cubo),
+            fechamentos=fechamentos,
+        )
+        return empresa, linhas, None
+    except Exception as e:
+        logging.error(f"[lote] Falha ao apurar {empresa} ({path}): {e}")
+        return empresa, [], str(e)
+
+
+def apurar_empresas(empresas, ano, meses, considerar_acumulo_previos=True, max_workers=None):
+    """Apura todas as empresas em paralelo, uma por processo.
+
+    ``empresas`` é ``{empresa: caminho}`` (ver ``descobrir_empresas``).
+    Retorna ``(tabela, erros)``: a tabela consolidada tem uma linha por
+    empresa e mês, com a coluna "Empresa" na frente; ``erros`` é
+    ``{empresa: mensagem}`` das que falharam.
+    """
+    if max_workers is None:
+        max_workers = min(len(empresas), os.cpu_count() or 1)
+    tarefas = [
+        (empresa, str(path), ano, list(meses), considerar_acumulo_previos)
+        for empresa, path in empresas.items()
+    ]
+    if max_workers <= 1:
+        resultados = [apurar_empresa(*t) for t in tarefas]
+    else:
+        # "spawn" em qualquer SO: fork de um processo com as threads do Streamlit não é seguro
+        contexto = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=contexto) as pool:
+            resultados = list(pool.map(apurar_empresa, *zip(*tarefas)))
+
+    linhas, erros = [], {}
+    for empresa, relatorio, erro in resultados:
+        if erro:
+            erros[empresa] = erro
+        linhas.extend({"Empresa": empresa, **linha} for linha in relatorio)
+    return pd.DataFrame(linhas), erros
+
+
+def versao_empresas(empresas):
+    """Versão do conjunto de planilhas: (empresa, tamanho, mtime) de cada uma e dos seus fechamentos."""
+    return tuple(
+        (empresa, impressao_arquivo(path), impressao_arquivo(arquivo_fechamentos(path)))
+        for empresa, path in empresas.items()
+    )
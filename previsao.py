@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+from .cenarios import ALIQUOTAS_ENTRADA_ICMS, ALIQUOTAS_SAIDA_ICMS
+from .cubo import classificar_grupo, eh_tributavel
+from .dados import preparar_notas
+
+# colunas com os mesmos sufixos das chaves dos campos dos simuladores
+COLUNAS_ICMS = [f"e{round(a * 100)}" for a in ALIQUOTAS_ENTRADA_ICMS] + [f"s{round(a * 100)}" for a in ALIQUOTAS_SAIDA_ICMS]
+COLUNAS_PC = ["be", "bs"]
+COLUNAS_BASES = COLUNAS_ICMS + COLUNAS_PC
+METODOS = {
+    "sazonal": "Sazonal (mesmo mês do ano anterior)",
+    "media_movel": "Média móvel dos últimos meses",
+}
+
+
+def _faixa_mais_proxima(aliquota, aliquotas):
+    # índice da alíquota nominal mais próxima da efetiva (ICMS / valor líquido)
+    return np.abs(aliquota[:, None] - np.asarray(aliquotas)[None, :]).argmin(axis=1)
+
+
+def bases_por_aliquota(df):
+    """Bases mensais por faixa de alíquota, calculadas das notas numa única agregação.
+
+    Cada nota com ICMS entra na faixa nominal mais próxima da sua alíquota
+    efetiva (4/7/12/19% nas entradas de Revenda e Frete, 11/12/19% nas
+    saídas); as bases de PIS/COFINS (``be``/``bs``) são os valores líquidos
+    das mesmas notas usadas na apuração. Retorna um DataFrame em reais
+    indexado por ``periodo`` (ano * 12 + mes - 1), com as colunas ``COLUNAS_BASES``.
+    """
+    df = preparar_notas(df) if df is not None else pd.DataFrame()
+    vazio = pd.DataFrame(columns=COLUNAS_BASES, dtype=float, index=pd.Index([], name="periodo"))
+    if df.empty or "periodo" not in df.columns or "valor_liquido" not in df.columns:
+        return vazio
+
+    periodo = df["periodo"].to_numpy(dtype=np.int64)
+    liq = df["valor_liquido"].to_numpy(dtype=np.int64)
+    icms = df["valor_icms"].to_numpy(dtype=np.int64) if "valor_icms" in df.columns else np.zeros_like(liq)
+    tipo = df["Tipo"]
+    validas = (df["ano"] > 0).to_numpy()
+    entrada = tipo.eq("Entrada").to_numpy() & eh_tributavel(classificar_grupo(df["Classificação"])) & validas
+    saida = tipo.eq("Saída").to_numpy() & validas
+    if not (entrada.any() or saida.any()):
+        return vazio
+
+    com_icms = (liq > 0) & (icms > 0)
+    aliquota = np.divide(icms, liq, out=np.zeros(len(liq)), where=com_icms)
+    n_ent = len(ALIQUOTAS_ENTRADA_ICMS)
+    coluna_icms = np.full(len(liq), -1)
+    coluna_icms[entrada & com_icms] = _faixa_mais_proxima(aliquota[entrada & com_icms], ALIQUOTAS_ENTRADA_ICMS)
+    coluna_icms[saida & com_icms] = n_ent + _faixa_mais_proxima(aliquota[saida & com_icms], ALIQUOTAS_SAIDA_ICMS)
+    coluna_pc = np.where(entrada, len(COLUNAS_ICMS), np.where(saida, len(COLUNAS_ICMS) + 1, -1))
+
+    # uma só bincount sobre (período, coluna) para as faixas de ICMS e as bases de PIS/COFINS
+    colunas = np.concatenate([coluna_icms, coluna_pc])
+    periodos = np.concatenate([periodo, periodo])
+    pesos = np.concatenate([liq, liq])
+    usar = colunas >= 0
+    inicio = periodos[usar].min()
+    n_periodos = periodos[usar].max() - inicio + 1
+    chave = (periodos[usar] - inicio) * len(COLUNAS_BASES) + colunas[usar]
+    somas = np.bincount(chave, weights=pesos[usar], minlength=n_periodos * len(COLUNAS_BASES))
+    return pd.DataFrame(
+        somas.reshape(n_periodos, len(COLUNAS_BASES)) / 100,
+        index=pd.RangeIndex(inicio, inicio + n_periodos, name="periodo"),
+        columns=COLUNAS_BASES,
+    )
+
+
+def prever_bases(historico, meses, metodo="sazonal", janela=3):
+    """Projeta as bases dos ``meses`` [(ano, mes), ...] a partir do histórico.
+
+    ``historico`` é a saída de ``bases_por_aliquota``; só os períodos
+    anteriores ao primeiro mês projetado são usados. ``"sazonal"`` repete o
+    mesmo mês do ano anterior (caindo na média móvel quando esse mês não
+    existe no histórico); ``"media_movel"`` usa a média dos últimos
+    ``janela`` meses. Retorna um DataFrame indexado por (ano, mes).
+    """
+    if not meses:
+        return pd.DataFrame(columns=COLUNAS_BASES, dtype=float)
+    indice = pd.MultiIndex.from_tuples(meses, names=["ano", "mes"])
+    alvo = np.array([ano * 12 + mes - 1 for ano, mes in meses])
+    corte = alvo.min()
+    passado = historico[historico.index < corte]
+    if passado.empty:
+        return pd.DataFrame(0.0, index=indice, columns=COLUNAS_BASES)
+
+    # série contínua até o mês anterior ao corte (meses sem notas = 0)
+    denso = passado.reindex(pd.RangeIndex(passado.index.min(), corte), fill_value=0.0).to_numpy()
+    media = denso[-janela:].mean(axis=0)
+    previsao = np.broadcast_to(media, (len(alvo), len(COLUNAS_BASES))).copy()
+    if metodo == "sazonal":
+        posicao = alvo - 12 - (corte - len(denso))
+        tem_sazonal = (posicao >= 0) & (posicao < len(denso))
+        previsao[tem_sazonal] = denso[posicao[tem_sazonal]]
+    elif metodo != "media_movel":
+        raise ValueError(f"método desconhecido: {metodo}")
+    return pd.DataFrame(np.maximum(previsao, 0.0).round(2), index=indice, columns=COLUNAS_BASES)
+
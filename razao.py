@@ -0,0 +1,31 @@
+"""Razão de créditos persistido ao lado da planilha.
+
+O razão (``apuracao.montar_razao``) cobre todos os anos das notas num só
+transporte; salvo na pasta de cache, o saldo de abertura de qualquer mês
+fica disponível sem reapurar os anos anteriores.
+"""
+import logging
+
+from .apuracao import montar_razao
+from .dados import VERSAO_CACHE, abrir_tabela, gravar_json, ler_json, ler_meta_cache, pasta_cache, salvar_tabela
+
+
+def razao_da_planilha(path, cubo):
+    """Razão salvo para a versão atual da planilha; refeito a partir do ``cubo`` quando ela muda."""
+    pasta = pasta_cache(path)
+    meta = ler_meta_cache(path)
+    salvo = ler_json(pasta / "razao.json")
+    if meta and salvo and salvo.get("versao") == VERSAO_CACHE and salvo.get("sha256") == meta["sha256"]:
+        try:
+            return abrir_tabela(pasta, salvo).set_index("periodo")
+        except Exception as e:
+            logging.warning(f"[razao] Falha ao ler razão salvo: {e}")
+
+    razao = montar_razao(cubo)
+    if meta:
+        try:
+            info = salvar_tabela(pasta, "razao", razao.reset_index())
+            gravar_json(pasta / "razao.json", {"versao": VERSAO_CACHE, "sha256": meta["sha256"], **info})
+        except OSError as e:
+            logging.warning(f"[razao] Não foi possível gravar o razão: {e}")
+    return razao
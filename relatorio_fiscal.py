@@ -1,11 +1,26 @@
 import streamlit as st
 import pandas as pd
-import logging
+import numpy as np
+import plotly.express as px
 import re
+import logging
 from pathlib import Path
-from io import BytesIO
 
 from .meses import MESES_PT, MES_PARA_NUM
+from .apuracao import (  # núcleo de cálculo, reexportado para quem já importava daqui
+    ALIQUOTA_PIS_COFINS_PB, ALIQUOTAS_ENTRADA_ICMS_PB, ALIQUOTAS_SAIDA_ICMS_PB, PROTEGE_SAIDA_11_PB,
+    _credito_acumulado_atual, _meses_restantes_do_ano, _rollforward, _ultimo_mes_vigente,
+    aplicar_aliquota, derive_kpis, format_brl, gerar_excel_resumo,
+    montar_razao, moeda_format, moeda_to_float, parse_col,
+)
+from . import apuracao
+from .cubo import como_cubo
+from .dados import reais_para_centavos
+from .fechamento import divergencias, fechar_mes, reabrir_mes
+from .lote import apurar_empresas, descobrir_empresas, versao_empresas
+from .cenarios import DRIVERS, grade_sensibilidade
+from .delta import aplicar_delta, atualizar_razao, cubo_do_delta, linhas_alteradas
+from .previsao import COLUNAS_ICMS, COLUNAS_PC, METODOS, bases_por_aliquota, prever_bases
 
 # Helper opcional de compatibilidade para rerun
 def _safe_rerun():
@@ -15,202 +30,51 @@ def _safe_rerun():
     elif hasattr(st, "experimental_rerun"):
         st.experimental_rerun()
 
-# Configuração de log detalhado
-LOG_PATH = Path(__file__).resolve().parent / "reports" / "relatorio_fiscal_debug.log"
-LOG_PATH.parent.mkdir(exist_ok=True)
-logging.basicConfig(
-    filename=str(LOG_PATH),
-    level=logging.DEBUG,
-    format='%(asctime)s | %(levelname)s | %(message)s',
-    filemode='a'
-)
+MIME_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
-def parse_col(serie, colname=""):
-    serie = serie.replace({r"R\$": "", ".": "", ",": "."}, regex=True)
-    numeric = pd.to_numeric(serie, errors="coerce").fillna(0)
-    logging.debug(f"[parse_col] [{colname}] Amostra: {numeric.head(5).tolist()}")
-    return numeric
 
-def moeda_format(valor):
-    """Formata valor para padrão brasileiro: R$ 12.345,67"""
-    try:
-        if isinstance(valor, str):
-            # Remove tudo exceto dígitos e vírgula
-            valor = re.sub(r'[^\d,]', '', valor)
-            # Converte vírgula para ponto para processamento
-            valor = valor.replace(',', '.')
-        valor = float(valor)
-        return f"R$ {valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    except:
-        return "R$ 0,00"
-
-def moeda_to_float(valor_texto):
-    """Converte texto no formato brasileiro para float"""
+def calcular_resumo_fiscal_mes_a_mes(*args, **kwargs):
+    """``apuracao.calcular_resumo_fiscal_mes_a_mes`` para a interface: um erro no
+    cálculo vai para o log e a tela mostra o relatório vazio, sem derrubar a página."""
     try:
-        if not valor_texto:
-            return 0.0
-        # Remove tudo exceto dígitos e vírgula
-        valor = re.sub(r'[^\d,]', '', valor_texto)
-        # Converte vírgula para ponto
-        valor = valor.replace(',', '.')
-        return float(valor)
-    except:
-        return 0.0
-
-
-def _saldo_inicial_acumulado(df, ano, mes_inicial):
-    """Calcula créditos acumulados de ICMS e PIS/COFINS antes de ``mes_inicial``."""
-    df = df.copy()
-    df["Data Emissão"] = pd.to_datetime(df["Data Emissão"], format="%d/%m/%Y", errors="coerce")
-    df = df[(df["Data Emissão"].dt.year == ano) & (df["Data Emissão"].dt.month < mes_inicial)]
-    if df.empty:
-        return 0.0, 0.0
-
-    meses = sorted(df["Data Emissão"].dt.month.dropna().unique())
-    credito_icms = 0.0
-    credito_pc = 0.0
-    for mes in meses:
-        df_mes = df[df["Data Emissão"].dt.month == mes]
-
-        filtro_entradas = (
-            df_mes["Tipo"].eq("Entrada") &
-            df_mes["Classificação"].str.contains(r"(Mercadoria para Revenda|Frete)", case=False, na=False)
-        )
-        df_entradas = df_mes[filtro_entradas].copy()
-        filtro_saidas = df_mes["Tipo"].eq("Saída")
-        df_saidas = df_mes[filtro_saidas].copy()
-
-        total_liq_entradas = parse_col(df_entradas.get("Valor Líquido", pd.Series(dtype=str))).sum()
-        total_liq_saidas = parse_col(df_saidas.get("Valor Líquido", pd.Series(dtype=str))).sum()
-
-        total_icms_entradas = parse_col(df_entradas.get("Valor ICMS", pd.Series(dtype=str))).sum()
-        total_icms_saidas = parse_col(df_saidas.get("Valor ICMS", pd.Series(dtype=str))).sum()
-
-        credito_total_icms = credito_icms + total_icms_entradas
-        saldo_icms = credito_total_icms - total_icms_saidas
-        credito_icms = saldo_icms if saldo_icms > 0 else 0.0
-
-        pis_cof_entradas = total_liq_entradas * 0.0925
-        pis_cof_saidas = total_liq_saidas * 0.0925
-        credito_total_pc = credito_pc + pis_cof_entradas
-        saldo_pc = credito_total_pc - pis_cof_saidas
-        credito_pc = saldo_pc if saldo_pc > 0 else 0.0
-
-    return credito_icms, credito_pc
+        return apuracao.calcular_resumo_fiscal_mes_a_mes(*args, **kwargs)
+    except Exception as e:
+        logging.error(f"Erro no cálculo fiscal: {e}")
+        return []
 
-def calcular_resumo_fiscal_mes_a_mes(df, ano_sel, meses_sel, considerar_acumulo_previos=True):
-    try:
-        df = df.copy()
-        df["Data Emissão"] = pd.to_datetime(df["Data Emissão"], format="%d/%m/%Y", errors="coerce")
-        df = df[df["Data Emissão"].dt.year == ano_sel]
-
-        if meses_sel:
-            if all(isinstance(m, int) for m in meses_sel):
-                meses_num = meses_sel
-            else:
-                meses_num = [MES_PARA_NUM.get(m, None) for m in meses_sel if m in MES_PARA_NUM]
-            meses_num = [m for m in meses_num if m]
-        else:
-            meses_num = list(range(1, 13))
-
-        credito_icms_acumulado = 0.0
-        credito_pis_cofins_acumulado = 0.0
-        if considerar_acumulo_previos and meses_num:
-            mes_base = min(meses_num)
-            credito_icms_acumulado, credito_pis_cofins_acumulado = _saldo_inicial_acumulado(
-                df, ano_sel, mes_base
-            )
 
-        relatorio_mensal = []
+def _download_tardio_disponivel():
+    """``st.download_button`` aceita um callable (gerado só no clique) a partir do 1.52."""
+    versao = tuple(int(p) for p in re.findall(r"\d+", st.__version__)[:2])
+    return versao >= (1, 52)
 
-        for mes in sorted(meses_num):
-            df_mes = df[df["Data Emissão"].dt.month == mes]
 
-            # Entradas: Mercadoria para Revenda OU Frete
-            filtro_entradas = (
-                df_mes["Tipo"].eq("Entrada") &
-                df_mes["Classificação"].str.contains(r"(Mercadoria para Revenda|Frete)", case=False, na=False)
-            )
-            df_entradas = df_mes[filtro_entradas].copy()
-            filtro_saidas = df_mes["Tipo"].eq("Saída")
-            df_saidas = df_mes[filtro_saidas].copy()
-
-            total_liq_entradas = parse_col(df_entradas.get("Valor Líquido", pd.Series(dtype=str)), "Valor Líquido Entradas").sum()
-            total_liq_saidas = parse_col(df_saidas.get("Valor Líquido", pd.Series(dtype=str)), "Valor Líquido Saídas").sum()
-            resultado_liq = total_liq_saidas - total_liq_entradas
-
-            total_icms_entradas = parse_col(df_entradas.get("Valor ICMS", pd.Series(dtype=str)), "Valor ICMS Entradas").sum()
-            total_icms_saidas = parse_col(df_saidas.get("Valor ICMS", pd.Series(dtype=str)), "Valor ICMS Saídas").sum()
-
-            # Guardar o saldo acumulado do início do mês
-            credito_icms_inicio = credito_icms_acumulado
-            credito_total_icms = credito_icms_inicio + total_icms_entradas
-            saldo_apuracao_icms = credito_total_icms - total_icms_saidas
-
-            if saldo_apuracao_icms < 0:
-                icms_a_pagar = abs(saldo_apuracao_icms)
-                icms_credito_transportado = 0.0
-            else:
-                icms_a_pagar = 0.0
-                icms_credito_transportado = saldo_apuracao_icms
-
-            # Atualizar acumulado apenas para o próximo mês
-            credito_icms_acumulado = icms_credito_transportado
-
-            # PIS/COFINS (9,25%)
-            pis_cof_entradas = total_liq_entradas * 0.0925
-            pis_cof_saidas = total_liq_saidas * 0.0925
-
-            credito_pis_cofins_inicio = credito_pis_cofins_acumulado
-            credito_total_pc = credito_pis_cofins_inicio + pis_cof_entradas
-            saldo_apuracao_pc = credito_total_pc - pis_cof_saidas
-
-            if saldo_apuracao_pc < 0:
-                pis_cofins_a_pagar = abs(saldo_apuracao_pc)
-                pis_cofins_credito_transportado = 0.0
-            else:
-                pis_cofins_a_pagar = 0.0
-                pis_cofins_credito_transportado = saldo_apuracao_pc
-
-            credito_pis_cofins_acumulado = pis_cofins_credito_transportado
-
-            relatorio_mensal.append({
-                "Ano": ano_sel,
-                "Mês": MESES_PT[mes],
-                "Entradas (Revenda + Frete)": total_liq_entradas,
-                "Saídas": total_liq_saidas,
-                "Resultado Líquido": resultado_liq,
-                "ICMS Entradas": total_icms_entradas,
-                "ICMS Saídas": total_icms_saidas,
-                "Crédito ICMS Acum. (início)": credito_icms_inicio,
-                "ICMS a Pagar": icms_a_pagar,
-                "Crédito ICMS Transportado": icms_credito_transportado,
-                "PIS/COFINS Entradas": pis_cof_entradas,
-                "PIS/COFINS Saídas": pis_cof_saidas,
-                "Crédito PIS/COFINS Acum. (início)": credito_pis_cofins_inicio,
-                "PIS/COFINS a Pagar": pis_cofins_a_pagar,
-                "Crédito PIS/COFINS Transportado": pis_cofins_credito_transportado,
-            })
-
-        return relatorio_mensal
+@st.cache_data(show_spinner=False)
+def _excel_resumo_bytes(versao, chave, _relatorio_mensal):
+    """xlsx memorizado por (versão dos dados, período); as linhas não são hasheadas."""
+    return gerar_excel_resumo(_relatorio_mensal).getvalue()
 
-    except Exception as e:
-        logging.error(f"Erro no cálculo fiscal: {e}")
-        return []
 
-def gerar_excel_resumo(relatorio_mensal):
-    buffer = BytesIO()
-    df_mensal = pd.DataFrame(relatorio_mensal)
-    with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-        df_mensal.to_excel(writer, index=False, sheet_name="Resumo Fiscal Mês a Mês")
-    buffer.seek(0)
-    return buffer
+def botao_download_resumo(label, relatorio_mensal, file_name, versao=None, chave=None):
+    """Botão de download cujo xlsx só é gerado quando o usuário pede.
 
-def format_brl(valor):
-    """Formata número para padrão brasileiro: R$ 12.345,67"""
-    if pd.isna(valor):
-        return "R$ 0,00"
-    return f"R$ {valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    Com ``versao`` e ``chave`` o arquivo fica memorizado entre reruns e
+    sessões; sem eles é gerado a cada pedido.
+    """
+    if versao is not None and chave is not None:
+        gerar = lambda: _excel_resumo_bytes(versao, chave, relatorio_mensal)
+    else:
+        gerar = lambda: gerar_excel_resumo(relatorio_mensal).getvalue()
+    key = f"download_{file_name}"
+    if _download_tardio_disponivel():
+        st.download_button(label=label, data=gerar, file_name=file_name, mime=MIME_XLSX, key=key)
+        return
+    # Versões antigas: um clique prepara a planilha e só então o download aparece
+    flag = f"{key}_pronto"
+    if st.button(f"Preparar: {label}", key=f"{key}_preparar"):
+        st.session_state[flag] = True
+    if st.session_state.get(flag):
+        st.download_button(label=label, data=gerar(), file_name=file_name, mime=MIME_XLSX, key=key)
 
 def mostrar_resumo_fiscal(df, ano_sel=None, meses_sel=None):
     if df.empty or "Data Emissão" not in df.columns:
@@ -263,64 +127,96 @@ def mostrar_resumo_fiscal(df, ano_sel=None, meses_sel=None):
         "Crédito PIS/COFINS Transportado": lambda x: format_brl(x),
     }), use_container_width=True)
 
-    excel_buffer = gerar_excel_resumo(relatorio_mensal)
-    st.download_button(
-        label="📥 Baixar planilha com os cálculos mês a mês",
-        data=excel_buffer,
-        file_name="resumo_fiscal_mes_a_mes.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    botao_download_resumo(
+        "📥 Baixar planilha com os cálculos mês a mês",
+        relatorio_mensal,
+        "resumo_fiscal_mes_a_mes.xlsx",
     )
 
 
-def _ultimo_mes_vigente(df):
-    datas = pd.to_datetime(df.get("Data Emissão", pd.Series([])), format="%d/%m/%Y", errors="coerce") if df is not None else pd.Series([], dtype="datetime64[ns]")
-    max_data = datas.max()
-    if pd.isna(max_data):
-        hoje = pd.Timestamp.today()
-        return hoje.year, hoje.month
-    return int(max_data.year), int(max_data.month)
-
-
-def _meses_restantes_do_ano(ano, mes_inicio):
-    return [(ano, m) for m in range(mes_inicio, 13)]
-
-
-def _credito_acumulado_atual(df, ano, mes_vig, imposto):
-    if df is None or df.empty or mes_vig <= 1:
-        return 0.0
-    meses_prev = list(range(1, mes_vig))
-    resumo = calcular_resumo_fiscal_mes_a_mes(df, ano, meses_prev)
-    if not resumo:
-        return 0.0
-    ultimo = resumo[-1]
-    if imposto == "icms":
-        return ultimo.get("Crédito ICMS Transportado", 0.0) or 0.0
-    return ultimo.get("Crédito PIS/COFINS Transportado", 0.0) or 0.0
-
-
-def _rollforward(credito_inicial, creditos, debitos, periodos):
-    resultados = []
-    credito_atual = credito_inicial
-    for (ano, mes), cred, deb in zip(periodos, creditos, debitos):
-        consumo = min(deb, cred + credito_atual)
-        a_pagar = deb - consumo
-        credito_final = max(cred + credito_atual - consumo, 0.0)
-        resultados.append(
-            {
-                "Período": f"{ano}-{mes:02d}",
-                "Ano": ano,
-                "Mês": MESES_PT[mes],
-                "Crédito Inicial": credito_atual,
-                "Crédito do Mês": cred,
-                "Débito do Mês": deb,
-                "A Pagar": a_pagar,
-                "Crédito Final": credito_final,
-            }
+
+@st.cache_data(show_spinner=False)
+def _apuracao_empresas(raiz, versao, ano, meses):
+    """Apuração consolidada, memorizada pela versão de todas as planilhas."""
+    return apurar_empresas(descobrir_empresas(raiz), ano, meses)
+
+
+def mostrar_apuracao_empresas(raiz, ano_sel, meses_sel):
+    """Apuração de todas as empresas encontradas sob ``raiz`` numa única tabela."""
+    empresas = descobrir_empresas(raiz) if Path(raiz).exists() else {}
+    if not empresas:
+        st.warning(f"Nenhuma planilha de notas encontrada em {raiz}.")
+        return
+
+    st.caption(f"{len(empresas)} empresas encontradas em {raiz}")
+    versao = versao_empresas(empresas)
+    with st.spinner("Apurando as empresas..."):
+        tabela, erros = _apuracao_empresas(str(raiz), versao, ano_sel, tuple(meses_sel))
+    for empresa, erro in erros.items():
+        st.error(f"{empresa}: {erro}")
+    if tabela.empty:
+        st.info("Nenhum dado fiscal apurado para o período.")
+        return
+
+    totais = tabela.groupby("Empresa", sort=True).agg(**{
+        "ICMS a Pagar": ("ICMS a Pagar", "sum"),
+        "PIS/COFINS a Pagar": ("PIS/COFINS a Pagar", "sum"),
+        "Crédito ICMS Transportado": ("Crédito ICMS Transportado", "last"),
+        "Crédito PIS/COFINS Transportado": ("Crédito PIS/COFINS Transportado", "last"),
+    }).reset_index()
+    colunas_valor = [c for c in totais.columns if c != "Empresa"]
+    st.subheader("Resumo por empresa")
+    st.dataframe(totais.style.format({c: format_brl for c in colunas_valor}), use_container_width=True)
+
+    st.subheader("Apuração mês a mês")
+    colunas_valor = [c for c in tabela.columns if c not in ("Empresa", "Ano", "Mês")]
+    st.dataframe(tabela.style.format({c: format_brl for c in colunas_valor}), use_container_width=True)
+
+    botao_download_resumo(
+        "📥 Baixar apuração consolidada (.xlsx)",
+        tabela.to_dict("records"),
+        f"apuracao_empresas_{ano_sel}.xlsx",
+        versao=versao,
+        chave=(ano_sel, tuple(meses_sel), "empresas"),
+    )
+
+
+@st.cache_data(show_spinner=False)
+def _divergencias_memo(versao, assinatura, _fechamentos, _cubo):
+    return divergencias(_fechamentos, _cubo)
+
+
+def avisar_divergencias(fechamentos, cubo, versao=None, assinatura=None):
+    """Aviso para meses fechados cujas notas mudaram depois do fechamento."""
+    if not fechamentos or cubo is None:
+        return
+    if versao is None:
+        meses = divergencias(fechamentos, cubo)
+    else:
+        meses = _divergencias_memo(versao, assinatura, fechamentos, cubo)
+    if meses:
+        lista = ", ".join(f"{MESES_PT[mes]}/{ano}" for ano, mes in meses)
+        st.warning(
+            f"As notas de meses já fechados mudaram depois do fechamento: {lista}. "
+            "Os valores exibidos são os gravados no fechamento; reabra o mês para reapurar."
         )
-        credito_atual = credito_final
-    return resultados
 
 
+def controle_fechamento(path, ano, mes, fechamentos, razao, cubo):
+    """Botão de fechar (ou reabrir) o mês, exibido na apuração de cada mês."""
+    registro = (fechamentos or {}).get(ano * 12 + mes - 1)
+    try:
+        if registro is not None:
+            st.caption(f"🔒 Mês fechado em {registro['fechado_em']} (versão {registro['versao']})")
+            if st.button("Reabrir mês", key=f"reabrir_{ano}_{mes}"):
+                reabrir_mes(path, ano, mes)
+                _safe_rerun()
+        elif razao is not None and st.button("🔒 Fechar mês", key=f"fechar_{ano}_{mes}"):
+            fechar_mes(path, ano, mes, razao, cubo)
+            _safe_rerun()
+    except (ValueError, OSError) as e:
+        st.error(f"Não foi possível alterar o fechamento: {e}")
+
 def chip(texto: str, color: str) -> str:
     classes = {
         "green": "badge badge-green",
@@ -329,44 +225,6 @@ def chip(texto: str, color: str) -> str:
     return f"<span class='{classes.get(color, 'badge')}'>{texto}</span>"
 
 
-def derive_kpis(df: pd.DataFrame) -> dict:
-    if df is None or df.empty:
-        return {
-            "total_a_pagar": 0.0,
-            "meses_com_pagamento": 0,
-            "primeiro_mes_pagamento": "-",
-            "valor_primeiro_mes": 0.0,
-            "credito_final_dezembro": 0.0,
-            "mes_maior_pagamento": "-",
-            "valor_maior_pagamento": 0.0,
-        }
-
-    total_a_pagar = float(df["A Pagar"].sum())
-    meses_pag = df[df["A Pagar"] > 0]
-    meses_com_pagamento = int((df["A Pagar"] > 0).sum())
-    if not meses_pag.empty:
-        primeiro = meses_pag.iloc[0]
-        primeiro_mes = f"{primeiro['Mês']}/{primeiro['Ano']}"
-        valor_primeiro = float(primeiro["A Pagar"])
-    else:
-        primeiro_mes = "-"
-        valor_primeiro = 0.0
-    ultimo = df.iloc[-1]
-    credito_final_dez = float(ultimo["Crédito Final"])
-    idxmax = df["A Pagar"].idxmax()
-    mes_maior = f"{df.loc[idxmax, 'Mês']}/{df.loc[idxmax, 'Ano']}"
-    valor_maior = float(df.loc[idxmax, "A Pagar"])
-    return {
-        "total_a_pagar": total_a_pagar,
-        "meses_com_pagamento": meses_com_pagamento,
-        "primeiro_mes_pagamento": primeiro_mes,
-        "valor_primeiro_mes": valor_primeiro,
-        "credito_final_dezembro": credito_final_dez,
-        "mes_maior_pagamento": mes_maior,
-        "valor_maior_pagamento": valor_maior,
-    }
-
-
 def inject_css():
     st.markdown(
         """
@@ -450,13 +308,135 @@ def render_month_list(df: pd.DataFrame, detalhes: dict | None = None):
 
 
 
-def simulador_icms_manual(df=None, ano_sel=None, meses_sel=None):
+FAIXAS_DRIVERS = {
+    "volume_entradas": (0.0, 3.0, (0.5, 1.5)),
+    "volume_saidas": (0.0, 3.0, (0.5, 1.5)),
+    "participacao_4": (0.0, 1.0, (0.0, 1.0)),
+}
+METRICAS_SENSIBILIDADE = {
+    "total_a_pagar": "Total a pagar (restante do ano)",
+    "credito_final_dezembro": "Crédito final (dez)",
+    "meses_com_pagamento": "Meses com pagamento",
+    "primeiro_mes_pagamento": "1º mês com pagamento (0 = nenhum)",
+}
+
+
+def render_sensibilidade(imposto, credito_inicial, entradas, saidas, meses):
+    """Mapa de calor de uma métrica da projeção varrendo dois drivers.
+
+    As bases digitadas no simulador são o ponto 1×; os resultados de cada
+    ponto ficam no ``session_state`` e mudar os limites da grade só calcula
+    os pontos novos.
+    """
+    drivers = DRIVERS[imposto]
+    with st.expander("Análise de sensibilidade"):
+        if not np.any(entradas) and not np.any(saidas):
+            st.info("Preencha as bases dos meses para analisar a sensibilidade.")
+            return
+        nomes = list(drivers)
+        col_x, col_y = st.columns(2)
+        driver_x = col_x.selectbox("Eixo X", nomes, format_func=drivers.get, key=f"sens_{imposto}_x")
+        driver_y = col_y.selectbox(
+            "Eixo Y", [n for n in nomes if n != driver_x], format_func=drivers.get, key=f"sens_{imposto}_y"
+        )
+        faixas = {}
+        for col, driver in ((col_x, driver_x), (col_y, driver_y)):
+            minimo, maximo, padrao = FAIXAS_DRIVERS[driver]
+            faixas[driver] = col.slider(
+                "Faixa", minimo, maximo, padrao, step=0.05, key=f"sens_{imposto}_{driver}_faixa"
+            )
+        pontos = st.slider("Pontos por eixo", 3, 41, 11, step=2, key=f"sens_{imposto}_pontos")
+        metrica = st.selectbox(
+            "Métrica", list(METRICAS_SENSIBILIDADE), format_func=METRICAS_SENSIBILIDADE.get,
+            key=f"sens_{imposto}_metrica",
+        )
+
+        grade = grade_sensibilidade(
+            imposto, credito_inicial, entradas, saidas,
+            driver_x, np.linspace(*faixas[driver_x], pontos),
+            driver_y, np.linspace(*faixas[driver_y], pontos),
+            meses=[mes for _, mes in meses],
+            cache=st.session_state.setdefault("sensibilidade_cache", {}),
+        )[metrica]
+        fig = px.imshow(
+            grade.to_numpy(),
+            x=grade.columns.to_list(),
+            y=grade.index.to_list(),
+            labels={"x": drivers[driver_x], "y": drivers[driver_y], "color": METRICAS_SENSIBILIDADE[metrica]},
+            origin="lower",
+            aspect="auto",
+            color_continuous_scale="RdYlGn_r" if metrica != "credito_final_dezembro" else "RdYlGn",
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+
+@st.cache_data(show_spinner=False)
+def _mes_vigente_memo(versao, _df):
+    return _ultimo_mes_vigente(_df)
+
+
+@st.cache_data(show_spinner=False)
+def _saldos_abertura_memo(versao, ano, mes, _df):
+    """Créditos de ICMS e PIS/COFINS acumulados até ``mes``, lidos de um só razão."""
+    razao = montar_razao(como_cubo(_df)) if _df is not None and not _df.empty else None
+    return {imposto: _credito_acumulado_atual(_df, ano, mes, imposto, razao) for imposto in ("icms", "pc")}
+
+
+def mes_vigente(df, versao=None):
+    """Ano e mês vigentes; com ``versao`` o resultado é memorizado entre reruns."""
+    df = df if df is not None else pd.DataFrame()
+    if versao is None:
+        return _ultimo_mes_vigente(df)
+    return _mes_vigente_memo(versao, df)
+
+
+def saldo_abertura(df, ano, mes, imposto, versao=None, razao=None):
+    """Crédito acumulado no início de ``mes`` para ``imposto`` ("icms" ou "pc").
+
+    Com ``razao`` o saldo é lido direto dele (fechamentos incluídos). Com
+    ``versao`` (versão dos dados) fica memorizado por (versão, ano, mês,
+    imposto): mexer nos campos do simulador não refaz a apuração do ano.
+    """
+    if razao is not None:
+        return _credito_acumulado_atual(df, ano, mes, imposto, razao)
+    if versao is None:
+        return _credito_acumulado_atual(df, ano, mes, imposto)
+    return _saldos_abertura_memo(versao, ano, mes, df)[imposto]
+
+
+@st.cache_data(show_spinner=False)
+def _bases_historicas_memo(versao, _notas):
+    return bases_por_aliquota(_notas)
+
+
+def render_preenchimento(prefixo, colunas, meses, notas, versao=None):
+    """Preenche os campos do simulador com as bases previstas a partir das notas.
+
+    As bases por alíquota são agregadas uma vez por versão dos dados; o
+    botão grava a previsão no ``session_state`` antes de os campos serem criados.
+    """
+    if notas is None or notas.empty:
+        return
+    historico = bases_por_aliquota(notas) if versao is None else _bases_historicas_memo(versao, notas)
+    if historico.empty:
+        return
+    col_m, col_b = st.columns([3, 1])
+    metodo = col_m.selectbox("Previsão das bases", list(METODOS), format_func=METODOS.get, key=f"{prefixo}_prev_metodo")
+    if col_b.button("Preencher com previsão", key=f"{prefixo}_prev_btn"):
+        previsao = prever_bases(historico, meses, metodo)
+        for (ano, mes), linha in previsao.iterrows():
+            for coluna in colunas:
+                st.session_state[f"{prefixo}_{ano}_{mes}_{coluna}"] = float(linha[coluna])
+
+
+def simulador_icms_manual(df=None, ano_sel=None, meses_sel=None, versao=None, notas=None, razao=None):
     st.header("Simulação Manual de ICMS")
-    ano_vig, mes_vig = _ultimo_mes_vigente(df if df is not None else pd.DataFrame())
-    credito_inicial = _credito_acumulado_atual(df, ano_vig, mes_vig, "icms")
+    ano_vig, mes_vig = mes_vigente(df, versao)
+    credito_inicial = saldo_abertura(df, ano_vig, mes_vig, "icms", versao, razao)
     st.markdown(f"Mês vigente: **{MESES_PT[mes_vig]} / {ano_vig}**")
     st.markdown(f"Crédito acumulado inicial: **{format_brl(credito_inicial)}**")
     meses = _meses_restantes_do_ano(ano_vig, mes_vig)
+    render_preenchimento("icms", COLUNAS_ICMS, meses, notas, versao)
     valores = {}
     for ano, mes in meses:
         with st.expander(f"{MESES_PT[mes]}/{ano}", expanded=(mes == mes_vig)):
@@ -473,53 +453,41 @@ def simulador_icms_manual(df=None, ano_sel=None, meses_sel=None):
             valores[(ano, mes)] = (e4, e7, e12, e19, s11, s12, s19)
 
     if st.button("Simular projeção", key="btn_icms_proj"):
-        detalhes = {}
-        linhas = []
-        credito_atual = credito_inicial
+        # bases digitadas em reais -> centavos; imposto por faixa arredondado ao centavo
+        centavos = {}
         for (ano, mes) in meses:
-            e4, e7, e12, e19, s11, s12, s19 = valores.get((ano, mes), (0, 0, 0, 0, 0, 0, 0))
-            c4 = e4 * 0.04
-            c7 = e7 * 0.07
-            c12 = e12 * 0.12
-            c19 = e19 * 0.19
-            total_cred = c4 + c7 + c12 + c19
-            d11 = s11 * 0.11
-            protege = s11 * 0.01
-            d12 = s12 * 0.12
-            d19 = s19 * 0.19
-            total_deb = d11 + protege + d12 + d19
-            consumo = min(total_deb, total_cred + credito_atual)
-            a_pagar = total_deb - consumo
-            credito_final = max(total_cred + credito_atual - consumo, 0.0)
-            detalhes[(ano, mes)] = {
+            bases = reais_para_centavos(valores.get((ano, mes), (0, 0, 0, 0, 0, 0, 0)))
+            c4, c7, c12, c19 = (int(v) for v in aplicar_aliquota(bases[:4], np.array(ALIQUOTAS_ENTRADA_ICMS_PB)))
+            d11, d12, d19 = (int(v) for v in aplicar_aliquota(bases[4:], np.array(ALIQUOTAS_SAIDA_ICMS_PB)))
+            protege = int(aplicar_aliquota(bases[4], PROTEGE_SAIDA_11_PB))
+            centavos[(ano, mes)] = {
                 "cred_4": c4,
                 "cred_7": c7,
                 "cred_12": c12,
                 "cred_19": c19,
-                "total_credito": total_cred,
+                "total_credito": c4 + c7 + c12 + c19,
                 "deb_11": d11,
                 "protege": protege,
                 "deb_12": d12,
                 "deb_19": d19,
-                "total_debito": total_deb,
-                "credito_inicial": credito_atual,
-                "consumo": consumo,
-                "a_pagar": a_pagar,
-                "credito_final": credito_final,
+                "total_debito": d11 + protege + d12 + d19,
             }
-            linhas.append(
-                {
-                    "Período": f"{ano}-{mes:02d}",
-                    "Ano": ano,
-                    "Mês": MESES_PT[mes],
-                    "Crédito Inicial": credito_atual,
-                    "Crédito do Mês": total_cred,
-                    "Débito do Mês": total_deb,
-                    "A Pagar": a_pagar,
-                    "Crédito Final": credito_final,
-                }
+        linhas = _rollforward(
+            reais_para_centavos(credito_inicial),
+            [det["total_credito"] for det in centavos.values()],
+            [det["total_debito"] for det in centavos.values()],
+            meses,
+        )
+        detalhes = {
+            periodo: {chave: valor / 100 for chave, valor in det.items()} for periodo, det in centavos.items()
+        }
+        for periodo, linha in zip(meses, linhas):
+            detalhes[periodo].update(
+                credito_inicial=linha["Crédito Inicial"],
+                consumo=linha["Consumo"],
+                a_pagar=linha["A Pagar"],
+                credito_final=linha["Crédito Final"],
             )
-            credito_atual = credito_final
         df_res = pd.DataFrame(linhas)
         st.session_state["icms_resultados"] = detalhes
         st.session_state["icms_df"] = df_res
@@ -534,14 +502,18 @@ def simulador_icms_manual(df=None, ano_sel=None, meses_sel=None):
         render_smart_notices(kpis)
         render_month_list(df_res, st.session_state.get("icms_resultados"))
 
+    bases = np.array([valores[p] for p in meses]).reshape(len(meses), 7)
+    render_sensibilidade("icms", credito_inicial, bases[:, :4], bases[:, 4:], meses)
+
 
-def simulador_pis_cofins_manual(df=None, ano_sel=None, meses_sel=None):
+def simulador_pis_cofins_manual(df=None, ano_sel=None, meses_sel=None, versao=None, notas=None, razao=None):
     st.header("Simulação Manual de PIS/COFINS")
-    ano_vig, mes_vig = _ultimo_mes_vigente(df if df is not None else pd.DataFrame())
-    credito_inicial = _credito_acumulado_atual(df, ano_vig, mes_vig, "pc")
+    ano_vig, mes_vig = mes_vigente(df, versao)
+    credito_inicial = saldo_abertura(df, ano_vig, mes_vig, "pc", versao, razao)
     st.markdown(f"Mês vigente: **{MESES_PT[mes_vig]} / {ano_vig}**")
     st.markdown(f"Crédito acumulado inicial: **{format_brl(credito_inicial)}**")
     meses = _meses_restantes_do_ano(ano_vig, mes_vig)
+    render_preenchimento("pc", COLUNAS_PC, meses, notas, versao)
     valores = {}
     for ano, mes in meses:
         with st.expander(f"{MESES_PT[mes]}/{ano}", expanded=(mes == mes_vig)):
@@ -549,12 +521,14 @@ def simulador_pis_cofins_manual(df=None, ano_sel=None, meses_sel=None):
             base_sai = st.number_input("Base Saídas", min_value=0.0, key=f"pc_{ano}_{mes}_bs")
             valores[(ano, mes)] = (base_ent, base_sai)
     if st.button("Simular projeção", key="btn_pc_proj"):
-        creditos, debitos, periodos = [], [], []
-        for (ano, mes), (be, bs) in valores.items():
-            creditos.append(be * 0.0925)
-            debitos.append(bs * 0.0925)
-            periodos.append((ano, mes))
-        resultados = _rollforward(credito_inicial, creditos, debitos, periodos)
+        periodos = list(valores)
+        bases = reais_para_centavos([valores[p] for p in periodos]).reshape(len(periodos), 2)
+        resultados = _rollforward(
+            reais_para_centavos(credito_inicial),
+            aplicar_aliquota(bases[:, 0], ALIQUOTA_PIS_COFINS_PB),
+            aplicar_aliquota(bases[:, 1], ALIQUOTA_PIS_COFINS_PB),
+            periodos,
+        )
         df_res = pd.DataFrame(resultados)
         st.session_state["pc_df"] = df_res
         st.session_state["pc_kpis"] = derive_kpis(df_res)
@@ -568,3 +542,86 @@ def simulador_pis_cofins_manual(df=None, ano_sel=None, meses_sel=None):
         render_smart_notices(kpis)
         render_month_list(df_res)
 
+    bases = np.array([valores[p] for p in meses]).reshape(len(meses), 2)
+    render_sensibilidade("pc", credito_inicial, bases[:, 0], bases[:, 1], meses)
+
+
+COLUNAS_COMPARACAO = ["ICMS a Pagar", "Crédito ICMS Transportado", "PIS/COFINS a Pagar", "Crédito PIS/COFINS Transportado"]
+
+
+def simulador_ajustes_notas(notas, cubo, razao, ano_sel, meses_sel, fechamentos=None):
+    """Simula exclusões e correções de notas sem reapurar o ano.
+
+    As notas editadas viram um cubo-delta (ver ``delta``) aplicado ao cubo e
+    ao razão em memória; o transporte é refeito só do mês alterado em diante.
+    """
+    st.header("Simulação de Ajustes nas Notas")
+    if notas is None or notas.empty or cubo is None or razao is None:
+        st.info("A simulação de ajustes precisa das notas carregadas (indisponível no modo armazém SQL).")
+        return
+
+    meses_num = sorted(meses_sel) if meses_sel else list(range(1, 13))
+    mes = st.selectbox("Mês das notas", meses_num, format_func=lambda m: f"{MESES_PT[m]}/{ano_sel}", key="ajuste_mes")
+    periodo = ano_sel * 12 + mes - 1
+    originais = notas[notas["periodo"] == periodo]
+    if originais.empty:
+        st.info("Nenhuma nota no mês selecionado.")
+        return
+    if periodo in (fechamentos or {}):
+        st.warning("Mês fechado: os ajustes só alteram os meses abertos seguintes se o mês for reaberto.")
+
+    st.caption("Marque notas para excluir ou corrija Tipo, Classificação e valores; a apuração é refeita a cada ajuste.")
+    classificacoes = sorted(notas["Classificação"].dropna().astype(str).unique().tolist())
+    tabela = pd.DataFrame({
+        "Excluir": False,
+        "Número": originais["Número"] if "Número" in originais.columns else None,
+        "Data Emissão": originais["Data Emissão"],
+        "UF Emitente": originais["UF Emitente"] if "UF Emitente" in originais.columns else None,
+        "Tipo": originais["Tipo"],
+        "Classificação": originais["Classificação"].astype("string"),
+        "Valor Líquido": originais["valor_liquido"] / 100,
+        "Valor ICMS": originais["valor_icms"] / 100,
+    }, index=originais.index)
+    editada = st.data_editor(
+        tabela,
+        key=f"ajuste_notas_{periodo}",
+        hide_index=True,
+        use_container_width=True,
+        disabled=["Número", "Data Emissão", "UF Emitente"],
+        column_config={
+            "Tipo": st.column_config.SelectboxColumn(options=["Entrada", "Saída"], required=True),
+            "Classificação": st.column_config.SelectboxColumn(options=classificacoes, required=True),
+            "Valor Líquido": st.column_config.NumberColumn(format="%.2f"),
+            "Valor ICMS": st.column_config.NumberColumn(format="%.2f"),
+        },
+    )
+
+    ajustadas = originais.assign(
+        Tipo=editada["Tipo"].to_numpy(),
+        **{"Classificação": editada["Classificação"].to_numpy()},
+        valor_liquido=reais_para_centavos(editada["Valor Líquido"]),
+        valor_icms=reais_para_centavos(editada["Valor ICMS"]),
+    )
+    removidas, incluidas = linhas_alteradas(originais, ajustadas, editada["Excluir"])
+    if removidas.empty and incluidas.empty:
+        st.info("Nenhum ajuste feito.")
+        return
+
+    delta = cubo_do_delta(removidas, incluidas)
+    antes = calcular_resumo_fiscal_mes_a_mes(None, ano_sel, meses_num, cubo=cubo, razao=razao, fechamentos=fechamentos)
+    depois = calcular_resumo_fiscal_mes_a_mes(
+        None, ano_sel, meses_num, cubo=aplicar_delta(cubo, delta),
+        razao=atualizar_razao(razao, delta, fechamentos), fechamentos=fechamentos,
+    )
+    comparacao = pd.DataFrame(antes)[["Ano", "Mês"]]
+    for coluna in COLUNAS_COMPARACAO:
+        comparacao[f"{coluna} (atual)"] = [linha[coluna] for linha in antes]
+        comparacao[f"{coluna} (ajustado)"] = [linha[coluna] for linha in depois]
+    st.markdown(f"**{len(removidas)} notas retiradas, {len(incluidas)} reincluídas com ajustes**")
+    c1, c2 = st.columns(2)
+    dif_icms = sum(l["ICMS a Pagar"] for l in depois) - sum(l["ICMS a Pagar"] for l in antes)
+    dif_pc = sum(l["PIS/COFINS a Pagar"] for l in depois) - sum(l["PIS/COFINS a Pagar"] for l in antes)
+    c1.metric("Diferença no ICMS a pagar", format_brl(dif_icms))
+    c2.metric("Diferença no PIS/COFINS a pagar", format_brl(dif_pc))
+    colunas_valor = [c for c in comparacao.columns if c not in ("Ano", "Mês")]
+    st.dataframe(comparacao.style.format({c: format_brl for c in colunas_valor}), use_container_width=True)
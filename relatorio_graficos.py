@@ -6,7 +6,8 @@ import plotly.express as px
 import plotly.graph_objects as go
 
 from app.meses import MESES_PT, MES_PARA_NUM
-from app.relatorio_fiscal import calcular_resumo_fiscal_mes_a_mes, parse_col
+from app.cubo import GRUPOS_TRIBUTAVEIS, como_cubo, fatiar, montar_cubo
+from app.relatorio_fiscal import calcular_resumo_fiscal_mes_a_mes
 
 def brl_format(val: float) -> str:
     """Formata número para R$ 1.234.567,89"""
@@ -198,7 +199,7 @@ def mostrar_entradas_saidas(
 
     Parâmetros
     ----------
-    df_entradas, df_saidas : DataFrames das notas.
+    df_entradas, df_saidas : DataFrames das notas ou fatias do cubo de agregação.
     anos : lista contendo o ano selecionado.
     meses : lista de números dos meses (1-12).
     somente_tributaveis : quando True, filtra apenas
@@ -209,23 +210,8 @@ def mostrar_entradas_saidas(
     meses_num = sorted(set(meses)) if meses else list(range(1, 13))
 
     def prepara(df: pd.DataFrame, is_entrada: bool) -> pd.DataFrame:
-        df = df.copy()
-        df["Data Emissão"] = pd.to_datetime(
-            df["Data Emissão"], format="%d/%m/%Y", errors="coerce"
-        )
-        df = df[
-            (df["Data Emissão"].dt.year == ano_sel)
-            & (df["Data Emissão"].dt.month.isin(meses_num))
-        ]
-        if is_entrada and somente_tributaveis:
-            df = df[
-                df["Classificação"].str.contains(
-                    r"(Mercadoria para Revenda|Frete)",
-                    case=False,
-                    na=False,
-                )
-            ]
-        return df
+        grupos = GRUPOS_TRIBUTAVEIS if is_entrada and somente_tributaveis else None
+        return fatiar(como_cubo(df), ano_sel, meses_num, grupos=grupos)
 
     df_ent = prepara(df_entradas, True)
     df_sai = prepara(df_saidas, False)
@@ -234,11 +220,11 @@ def mostrar_entradas_saidas(
     idx = range(1, 13) if is_full_year else sorted(meses_num)
 
     ent_mes = (
-        df_ent.groupby(df_ent["Data Emissão"].dt.month)["Valor Líquido"].sum()
+        (df_ent.groupby("mes")["valor_liquido"].sum() / 100)
         .reindex(idx, fill_value=0)
     )
     sai_mes = (
-        df_sai.groupby(df_sai["Data Emissão"].dt.month)["Valor Líquido"].sum()
+        (df_sai.groupby("mes")["valor_liquido"].sum() / 100)
         .reindex(idx, fill_value=0)
     )
 
@@ -355,7 +341,25 @@ def create_modern_pie_chart(df, names_col, values_col, title):
 def mostrar_dashboard(df_entradas: pd.DataFrame,
                       df_saidas: pd.DataFrame,
                       anos: list[int],
-                      meses: list[int]):
+                      meses: list[int],
+                      cubo: pd.DataFrame | None = None,
+                      razao: pd.DataFrame | None = None,
+                      fechamentos: dict | None = None):
+    """Painel de Entradas/Saídas, UFs e créditos de ICMS e PIS/COFINS.
+
+    Todos os gráficos leem do ``cubo`` de agregação; quando ele não é
+    informado, é montado a partir das duas abas. ``razao`` (ver ``apuracao.montar_razao``) dá o
+    crédito de abertura transportado dos anos anteriores; meses em
+    ``fechamentos`` saem dos valores gravados no fechamento.
+
+    O crédito de abertura da apuração do painel vem do cubo e do razão
+    completos, inclusive dos meses antes da seleção — o mesmo saldo da
+    "Apuração de Tributos Fiscais". Antes do cubo, só os meses selecionados
+    entravam na apuração do painel e a abertura era sempre zero. Os
+    gráficos mostram só entradas e saídas, que não dependem desse saldo.
+    """
+    if cubo is None:
+        cubo = montar_cubo(pd.concat([df_entradas, df_saidas], ignore_index=True))
 
     # CSS personalizado para o dashboard
     st.markdown("""
@@ -410,20 +414,15 @@ def mostrar_dashboard(df_entradas: pd.DataFrame,
     meses_num = sorted(set(meses)) if meses else list(range(1, 13))
 
     # 2) Filtrar
-    def filtrar(df: pd.DataFrame) -> pd.DataFrame:
-        df = df.copy()
-        df["Data Emissão"] = pd.to_datetime(df["Data Emissão"], format="%d/%m/%Y", errors="coerce")
-        return df[
-            (df["Data Emissão"].dt.year == ano_sel) &
-            (df["Data Emissão"].dt.month.isin(meses_num))
-        ]
-
-    df_ent_raw = filtrar(df_entradas)
-    df_sai_raw = filtrar(df_saidas)
-    df_ent = df_ent_raw.copy()
-    df_sai = df_sai_raw.copy()
-    df_ent["Valor Líquido"] = parse_col(df_ent.get("Valor Líquido", pd.Series(dtype=str)), "Valor Líquido Entradas")
-    df_sai["Valor Líquido"] = parse_col(df_sai.get("Valor Líquido", pd.Series(dtype=str)), "Valor Líquido Saídas")
+    def em_reais(df: pd.DataFrame) -> pd.DataFrame:
+        # o cubo guarda centavos; só converte para exibição
+        return df.assign(**{
+            "Valor Líquido": df["valor_liquido"] / 100,
+            "Valor ICMS": df["valor_icms"] / 100,
+        })
+
+    df_ent = em_reais(fatiar(cubo, ano_sel, meses_num, tipo="Entrada"))
+    df_sai = em_reais(fatiar(cubo, ano_sel, meses_num, tipo="Saída"))
 
     # 3) KPI Cards customizados
     total_ent = df_ent["Valor Líquido"].sum()
@@ -436,9 +435,8 @@ def mostrar_dashboard(df_entradas: pd.DataFrame,
 
     # 1) Mercadorias por Estado
     st.markdown('<h2 class="section-title">Mercadorias por Estado</h2>', unsafe_allow_html=True)
-    df_comp = df_ent[df_ent["Classificação"]
-                     .str.contains("Mercadoria para Revenda", case=False, na=False)]
-    comp_uf = df_comp.groupby("UF Emitente")["Valor Líquido"]\
+    df_comp = df_ent[df_ent["grupo"].eq("Revenda")]
+    comp_uf = df_comp.groupby("UF Emitente", observed=True)["Valor Líquido"]\
                      .sum().reset_index().rename(columns={"Valor Líquido":"Entradas"})
     # Apenas entradas, sem saídas
     df_merc = comp_uf.copy()
@@ -459,7 +457,7 @@ def mostrar_dashboard(df_entradas: pd.DataFrame,
 
     # 2) Pizza de crédito ICMS
     st.markdown('<h2 class="section-title">Distribuição do Crédito ICMS por UF</h2>', unsafe_allow_html=True)
-    df_credito_uf = df_ent.groupby("UF Emitente")["Valor ICMS"]\
+    df_credito_uf = df_ent.groupby("UF Emitente", observed=True)["Valor ICMS"]\
                           .sum().reset_index()
     df_credito_uf["LabelAbbr"] = df_credito_uf["Valor ICMS"].apply(abbr_format)
     fig_pie = create_modern_pie_chart(
@@ -472,9 +470,11 @@ def mostrar_dashboard(df_entradas: pd.DataFrame,
 
     # 3) ICMS
     st.markdown('<h2 class="section-title">Crédito x Débito de ICMS</h2>', unsafe_allow_html=True)
-    df_all = pd.concat([df_ent, df_sai], ignore_index=True)
-    rel_ic = calcular_resumo_fiscal_mes_a_mes(df_all, ano_sel, meses_num)
-    df_ic = pd.DataFrame(rel_ic)
+    # uma única apuração alimenta os gráficos de ICMS e de PIS/COFINS; o saldo
+    # de abertura vem do razão completo (meses anteriores à seleção inclusive)
+    rel_mensal = calcular_resumo_fiscal_mes_a_mes(None, ano_sel, meses_num, cubo=cubo, razao=razao,
+                                                  fechamentos=fechamentos)
+    df_ic = pd.DataFrame(rel_mensal)
     df_ic["Período"] = df_ic["Ano"].astype(str) + "-" + df_ic["Mês"].map(MES_PARA_NUM).apply(lambda m: f"{m:02d}")
     df_ic_long = df_ic.melt(
         id_vars=["Período"],
@@ -493,8 +493,7 @@ def mostrar_dashboard(df_entradas: pd.DataFrame,
 
     # 4) PIS & COFINS
     st.markdown('<h2 class="section-title">Crédito x Débito de PIS/COFINS</h2>', unsafe_allow_html=True)
-    rel_pc = calcular_resumo_fiscal_mes_a_mes(df_all, ano_sel, meses_num)
-    df_pc = pd.DataFrame(rel_pc)
+    df_pc = pd.DataFrame(rel_mensal)
     df_pc["Período"] = df_pc["Ano"].astype(str) + "-" + df_pc["Mês"].map(MES_PARA_NUM).apply(lambda m: f"{m:02d}")
     df_pc_long = df_pc.melt(
         id_vars=["Período"],
@@ -0,0 +1,14 @@
+"""Registra a pasta do repositório como o pacote ``app`` (o nome usado nos imports)."""
+import importlib.util
+import sys
+from pathlib import Path
+
+RAIZ = Path(__file__).resolve().parents[1]
+
+if "app" not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+        "app", RAIZ / "__init__.py", submodule_search_locations=[str(RAIZ)]
+    )
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules["app"] = modulo
+    spec.loader.exec_module(modulo)
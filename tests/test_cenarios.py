@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from app.apuracao import (
+    ALIQUOTA_PIS_COFINS_PB, ALIQUOTAS_ENTRADA_ICMS_PB, ALIQUOTAS_SAIDA_ICMS_PB, PROTEGE_SAIDA_11_PB, _rollforward,
+    aplicar_aliquota,
+)
+from app.cenarios import avaliar_pontos, creditos_debitos_icms, grade_sensibilidade
+from app.dados import reais_para_centavos
+
+
+def _simulador_icms(credito_inicial, bases):
+    """As contas do simulador manual de ICMS, mês a mês."""
+    creditos, debitos = [], []
+    for linha in bases:
+        centavos = reais_para_centavos(linha)
+        creditos.append(int(aplicar_aliquota(centavos[:4], np.array(ALIQUOTAS_ENTRADA_ICMS_PB)).sum()))
+        debitos.append(
+            int(aplicar_aliquota(centavos[4:], np.array(ALIQUOTAS_SAIDA_ICMS_PB)).sum())
+            + int(aplicar_aliquota(centavos[4], PROTEGE_SAIDA_11_PB))
+        )
+    return _rollforward(reais_para_centavos(credito_inicial), creditos, debitos, [(2025, m + 1) for m in range(len(bases))])
+
+
+def test_credito_arredondado_por_faixa():
+    creditos, _ = creditos_debitos_icms([[[1234.57, 1000.05, 333.33, 10.01]]], [[[0, 0, 0]]])
+    assert creditos.tolist() == [[16128]]
+
+
+@pytest.mark.parametrize("semente", range(10))
+def test_ponto_1x_igual_ao_simulador_icms(semente):
+    rng = np.random.default_rng(semente)
+    bases = np.round(rng.uniform(0, 200_000, size=(int(rng.integers(1, 13)), 7)), 2)
+    credito_inicial = round(float(rng.uniform(0, 50_000)), 2)
+    linhas = _simulador_icms(credito_inicial, bases)
+    ponto = avaliar_pontos("icms", credito_inicial, bases[:, :4], bases[:, 4:], "volume_entradas", "volume_saidas",
+                           [(1.0, 1.0)])
+    assert ponto["total_a_pagar"][0] == round(sum(linha["A Pagar"] for linha in linhas), 2)
+    assert ponto["credito_final_dezembro"][0] == linhas[-1]["Crédito Final"]
+
+
+@pytest.mark.parametrize("semente", range(10))
+def test_ponto_1x_igual_ao_simulador_pis_cofins(semente):
+    rng = np.random.default_rng(semente)
+    bases = np.round(rng.uniform(0, 500_000, size=(int(rng.integers(1, 13)), 2)), 2)
+    credito_inicial = round(float(rng.uniform(0, 50_000)), 2)
+    centavos = reais_para_centavos(bases)
+    linhas = _rollforward(
+        reais_para_centavos(credito_inicial),
+        aplicar_aliquota(centavos[:, 0], ALIQUOTA_PIS_COFINS_PB),
+        aplicar_aliquota(centavos[:, 1], ALIQUOTA_PIS_COFINS_PB),
+        [(2025, m + 1) for m in range(len(bases))],
+    )
+    grade = grade_sensibilidade("pc", credito_inicial, bases[:, 0], bases[:, 1],
+                                "volume_entradas", [1.0], "volume_saidas", [1.0])
+    assert grade["total_a_pagar"].iat[0, 0] == round(sum(linha["A Pagar"] for linha in linhas), 2)
+    assert grade["credito_final_dezembro"].iat[0, 0] == linhas[-1]["Crédito Final"]
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.apuracao import montar_razao
+from app.cubo import CHAVES_CUBO, VALORES_CUBO
+from app.delta import aplicar_delta, atualizar_razao
+
+
+def _cubo(linhas):
+    """Cubo a partir de ``(ano, mes, Tipo, grupo, valor_liquido, valor_icms, notas)`` em centavos."""
+    cubo = pd.DataFrame(
+        [(ano, mes, tipo, grupo, "PB", liq, icms, notas) for ano, mes, tipo, grupo, liq, icms, notas in linhas],
+        columns=CHAVES_CUBO + VALORES_CUBO + ["notas"],
+    )
+    return cubo.astype({"ano": np.int64, "mes": np.int64, "valor_liquido": np.int64, "valor_icms": np.int64,
+                        "notas": np.int64})
+
+
+def _confere(cubo, delta):
+    incremental = atualizar_razao(montar_razao(cubo), delta)
+    completo = montar_razao(aplicar_delta(cubo, delta))
+    pd.testing.assert_frame_equal(incremental, completo, check_dtype=False, check_index_type=False)
+    return incremental
+
+
+def test_nota_depois_do_ultimo_mes_usa_o_credito_transportado():
+    cubo = _cubo([(2024, 3, "Entrada", "Revenda", 55_000, 9_900, 1)])
+    delta = _cubo([(2024, 7, "Saída", "Outros", 27_778, 5_000, 1)])
+    razao = _confere(cubo, delta)
+    assert razao.loc[2024 * 12 + 6, "icms_a_pagar"] == 0
+    assert razao.loc[2024 * 12 + 6, "icms_credito_final"] == 4_900
+    assert (razao.loc[2024 * 12 + 3: 2024 * 12 + 5, "icms_credito_final"] == 9_900).all()
+
+
+def test_nota_antes_do_primeiro_mes():
+    cubo = _cubo([(2024, 6, "Saída", "Outros", 100_000, 18_000, 2)])
+    delta = _cubo([(2024, 2, "Entrada", "Frete", 40_000, 7_000, 1)])
+    _confere(cubo, delta)
+
+
+@pytest.mark.parametrize("semente", range(30))
+def test_delta_aleatorio_igual_a_reconstrucao(semente):
+    rng = np.random.default_rng(semente)
+
+    def linhas(n, ano_max):
+        return [
+            (int(rng.integers(2023, ano_max + 1)), int(rng.integers(1, 13)), str(rng.choice(["Entrada", "Saída"])),
+             str(rng.choice(["Revenda", "Frete", "Outros"])), int(rng.integers(1, 10**7)),
+             int(rng.integers(0, 10**6)), 1)
+            for _ in range(n)
+        ]
+
+    cubo = _cubo(linhas(20, 2024)).groupby(CHAVES_CUBO, as_index=False).sum()
+    # o delta alcança 2025: meses depois do fim do razão, com lacunas
+    delta = _cubo(linhas(int(rng.integers(1, 6)), 2025)).groupby(CHAVES_CUBO, as_index=False).sum()
+    _confere(cubo, delta)
@@ -0,0 +1,92 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.apuracao import COLUNAS_RAZAO
+from app.fechamento import (
+    FechamentosIlegiveis, arquivo_fechamentos, fechamentos_ativos, fechar_mes, ler_historico, reabrir_mes,
+    ultimos_fechamentos,
+)
+
+
+@pytest.fixture
+def planilha(tmp_path):
+    return tmp_path / "notas_fiscais.xlsx"
+
+
+@pytest.fixture
+def razao():
+    indice = pd.RangeIndex(2024 * 12, 2025 * 12, name="periodo")
+    razao = pd.DataFrame(0, index=indice, columns=COLUNAS_RAZAO, dtype=np.int64)
+    razao["ano"], razao["mes"] = indice // 12, indice % 12 + 1
+    razao["icms_credito_final"] = np.arange(12, dtype=np.int64) * 100
+    return razao
+
+
+def test_arquivo_ausente_e_nenhum_mes_fechado(planilha):
+    assert ler_historico(planilha) == {}
+    assert fechamentos_ativos(planilha) == {}
+
+
+def test_pasta_inacessivel_nao_e_nenhum_mes_fechado(tmp_path):
+    with pytest.raises(FechamentosIlegiveis):
+        fechamentos_ativos(tmp_path / "sem_pasta" / "notas_fiscais.xlsx")
+
+
+def test_ida_e_volta_com_versoes(planilha, razao):
+    fechar_mes(planilha, 2024, 3, razao, None)
+    reabrir_mes(planilha, 2024, 3)
+    assert fechamentos_ativos(planilha) == {}
+    fechar_mes(planilha, 2024, 3, razao, None)
+    ativos = fechamentos_ativos(planilha)
+    assert list(ativos) == [2024 * 12 + 2]
+    assert ativos[2024 * 12 + 2]["versao"] == 2
+    assert ativos[2024 * 12 + 2]["razao"]["icms_credito_final"] == 200
+    assert len(ler_historico(planilha)["2024-03"]) == 2
+    with pytest.raises(ValueError):
+        fechar_mes(planilha, 2024, 3, razao, None)
+
+
+def test_arquivo_ilegivel_nao_reabre_nem_e_regravado(planilha, razao):
+    fechar_mes(planilha, 2024, 3, razao, None)
+    bons = fechamentos_ativos(planilha)
+    arquivo = arquivo_fechamentos(planilha)
+    arquivo.write_text('{"versao": 1, "meses": {"2024-03": [', encoding="utf-8")
+
+    with pytest.raises(FechamentosIlegiveis):
+        fechamentos_ativos(planilha)
+    assert ultimos_fechamentos(planilha) == bons
+    with pytest.raises(FechamentosIlegiveis):
+        fechar_mes(planilha, 2024, 5, razao, None)
+    with pytest.raises(FechamentosIlegiveis):
+        reabrir_mes(planilha, 2024, 3)
+    assert arquivo.read_text(encoding="utf-8") == '{"versao": 1, "meses": {"2024-03": ['
+    assert not arquivo.with_suffix(".trava").exists()
+
+
+def test_formato_desconhecido_e_ilegivel(planilha):
+    arquivo_fechamentos(planilha).write_text('{"versao": 99, "meses": {}}', encoding="utf-8")
+    with pytest.raises(FechamentosIlegiveis):
+        ler_historico(planilha)
+
+
+def test_fechamentos_simultaneos_nao_se_perdem(planilha, razao):
+    inicio = threading.Barrier(12)
+    erros = []
+
+    def fechar(mes):
+        inicio.wait()
+        try:
+            fechar_mes(planilha, 2024, mes, razao, None)
+        except Exception as e:
+            erros.append(e)
+
+    threads = [threading.Thread(target=fechar, args=(mes,)) for mes in range(1, 13)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert erros == []
+    assert sorted(fechamentos_ativos(planilha)) == list(range(2024 * 12, 2025 * 12))
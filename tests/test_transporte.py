@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from app.transporte import confere_transporte, transportar_creditos
+
+
+@pytest.mark.parametrize("semente", range(20))
+def test_kernel_igual_a_referencia_em_centavos(semente):
+    rng = np.random.default_rng(semente)
+    forma = (3, int(rng.integers(1, 25)))
+    creditos = rng.integers(0, 5_000_000, size=forma, dtype=np.int64)
+    debitos = rng.integers(0, 5_000_000, size=forma, dtype=np.int64)
+    credito_inicial = rng.integers(0, 10_000_000, size=forma[0], dtype=np.int64)
+    assert confere_transporte(creditos, debitos, credito_inicial)
+    assert confere_transporte(creditos, debitos)
+
+
+@pytest.mark.parametrize("semente", range(20))
+def test_kernel_igual_a_referencia_em_float(semente):
+    rng = np.random.default_rng(semente)
+    forma = (2, 4, int(rng.integers(1, 25)))
+    creditos = rng.uniform(0, 50_000, size=forma)
+    debitos = rng.uniform(0, 50_000, size=forma)
+    assert confere_transporte(creditos, debitos, rng.uniform(0, 100_000, size=forma[:-1]))
+    assert confere_transporte(creditos, debitos, 1234.56)
+
+
+def test_confere_detecta_divergencia(monkeypatch):
+    import app.transporte as transporte
+
+    def errado(creditos, debitos, credito_inicial=0):
+        resultado = transportar_creditos(creditos, debitos, credito_inicial)
+        resultado["a_pagar"][..., -1] += 1
+        return resultado
+
+    monkeypatch.setattr(transporte, "transportar_creditos", errado)
+    assert not transporte.confere_transporte(np.array([[100, 0]]), np.array([[50, 80]]), 10)
+
+
+def test_saldo_inicial_consumido_antes_de_pagar():
+    resultado = transportar_creditos(np.array([0, 0, 0]), np.array([300, 300, 300]), 500)
+    assert resultado["a_pagar"].tolist() == [0, 100, 300]
+    assert resultado["credito_final"].tolist() == [200, 0, 0]
@@ -0,0 +1,76 @@
+"""Transporte de crédito mês a mês, comum a todos os tributos.
+
+Em cada mês o crédito disponível (saldo anterior + créditos do mês) é
+consumido pelos débitos; o que faltar é pago e o que sobrar segue para o
+mês seguinte. As mesmas regras valem para ICMS, PIS/COFINS e qualquer
+tributo novo, que entra como mais uma linha do array.
+"""
+import numpy as np
+
+
+def _tipo_transporte(*valores):
+    tipo = np.result_type(*(np.asarray(v) for v in valores))
+    return np.int64 if np.issubdtype(tipo, np.integer) else float
+
+
+def transportar_creditos(creditos, debitos, credito_inicial=0):
+    """Transporta o crédito ao longo do último eixo (meses) de ``creditos``/``debitos``.
+
+    As dimensões anteriores (tributos, cenários, ...) são processadas juntas:
+    o laço percorre só os meses. ``credito_inicial`` tem a forma dessas
+    dimensões (ou é escalar). Retorna um dicionário de arrays com a forma
+    de ``creditos``: ``credito_inicial`` (de cada mês), ``consumo``,
+    ``a_pagar`` e ``credito_final``. Entradas inteiras (centavos) são
+    transportadas em int64, sem arredondamento; as demais, em float.
+    """
+    tipo = _tipo_transporte(creditos, debitos, credito_inicial)
+    creditos, debitos = np.broadcast_arrays(np.asarray(creditos, dtype=tipo), np.asarray(debitos, dtype=tipo))
+    atual = np.array(np.broadcast_to(np.asarray(credito_inicial, dtype=tipo), creditos.shape[:-1]))
+    resultado = {
+        nome: np.empty(creditos.shape, dtype=tipo)
+        for nome in ("credito_inicial", "consumo", "a_pagar", "credito_final")
+    }
+    for j in range(creditos.shape[-1]):
+        disponivel = creditos[..., j] + atual
+        consumo = np.minimum(debitos[..., j], disponivel)
+        resultado["credito_inicial"][..., j] = atual
+        resultado["consumo"][..., j] = consumo
+        resultado["a_pagar"][..., j] = debitos[..., j] - consumo
+        atual = np.maximum(disponivel - consumo, 0)
+        resultado["credito_final"][..., j] = atual
+    return resultado
+
+
+def transportar_creditos_escalar(creditos, debitos, credito_inicial=0):
+    """Implementação de referência, um tributo e um mês por vez.
+
+    Usa ``int`` (centavos) ou ``float`` do Python, conforme as entradas.
+    Serve para conferir ``transportar_creditos``: para cada linha, os
+    resultados dos dois têm de ser idênticos.
+    """
+    converter = int if _tipo_transporte(creditos, debitos, credito_inicial) is np.int64 else float
+    saida = {"credito_inicial": [], "consumo": [], "a_pagar": [], "credito_final": []}
+    atual = converter(credito_inicial)
+    for credito, debito in zip(creditos, debitos):
+        disponivel = converter(credito) + atual
+        consumo = min(converter(debito), disponivel)
+        saida["credito_inicial"].append(atual)
+        saida["consumo"].append(consumo)
+        saida["a_pagar"].append(converter(debito) - consumo)
+        atual = max(disponivel - consumo, converter(0))
+        saida["credito_final"].append(atual)
+    return saida
+
+
+def confere_transporte(creditos, debitos, credito_inicial=0):
+    """True se o kernel vetorizado e a referência escalar coincidem bit a bit."""
+    tipo = _tipo_transporte(creditos, debitos, credito_inicial)
+    creditos, debitos = np.broadcast_arrays(np.asarray(creditos, dtype=tipo), np.asarray(debitos, dtype=tipo))
+    iniciais = np.broadcast_to(np.asarray(credito_inicial, dtype=tipo), creditos.shape[:-1])
+    vetorizado = transportar_creditos(creditos, debitos, iniciais)
+    for indice in np.ndindex(creditos.shape[:-1]):
+        referencia = transportar_creditos_escalar(creditos[indice], debitos[indice], iniciais[indice])
+        for nome, valores in referencia.items():
+            if not np.array_equal(vetorizado[nome][indice], np.array(valores)):
+                return False
+    return True
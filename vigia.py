@@ -0,0 +1,176 @@
+"""Vigia em segundo plano: prepara os dados antes do usuário pedir.
+
+Uma thread daemon confere a planilha a cada ``INTERVALO_VIGIA`` segundos
+e é a única que atualiza a cópia local dela (``app.espelho``). Quando a
+planilha ou os fechamentos mudam, monta um pacote novo — notas, cubo,
+razão e as apurações do ano corrente — e o publica numa única atribuição,
+então as sessões veem o pacote antigo inteiro ou o novo inteiro, nunca
+uma mistura. A interface usa sempre o último pacote publicado
+(``pacote_atual``), com o caminho e a versão dele; só antes do primeiro
+(``aguardar_pacote`` estourou o tempo) cai para as funções com cache.
+
+As planilhas das empresas (modo multiempresa) só têm os caches em disco
+aquecidos: a apuração consolidada roda em processos separados, que leem
+esses caches.
+"""
+import logging
+import threading
+import time
+from datetime import date
+from pathlib import Path
+
+from .apuracao import calcular_resumo_fiscal_mes_a_mes
+from .cubo import cubo_da_planilha
+from .dados import carregar_notas, impressao_arquivo
+from .espelho import espelhar
+from .fechamento import arquivo_fechamentos, assinatura_fechamentos, divergencias, fechamentos_ativos
+from .lote import descobrir_empresas
+from .razao import razao_da_planilha
+
+INTERVALO_VIGIA = 10
+# quanto a primeira sessão espera pelo primeiro pacote antes de carregar por conta própria
+ESPERA_PRIMEIRO_PACOTE = 60
+# varrer a pasta das empresas no compartilhamento é mais caro: com menos frequência
+INTERVALO_EMPRESAS = 300
+TODOS_OS_MESES = list(range(1, 13))
+
+_pacotes = {}
+_falhas = {}
+_publicacao = threading.Condition()
+_aquecidas = {}
+
+
+def anos_correntes(cubo):
+    """Anos com apuração pré-calculada: o do calendário (se houver notas) e o último com notas."""
+    anos = set(cubo.loc[cubo["ano"] > 0, "ano"].astype(int))
+    return sorted({max(anos)} | ({date.today().year} & anos)) if anos else []
+
+
+def preparar_pacote(origem, path=None, leitor=None, anterior=None):
+    """Notas, cubo, razão e apurações do ano corrente da planilha ``origem``.
+
+    ``path`` é de onde as notas são lidas (a cópia local); os fechamentos
+    vêm sempre da ``origem``. Se ``anterior`` é da mesma versão da planilha,
+    só as apurações são refeitas (mudaram apenas os fechamentos).
+    """
+    path = Path(path or origem)
+    versao = impressao_arquivo(path)
+    versao_fechamentos = impressao_arquivo(arquivo_fechamentos(origem))
+    if anterior and anterior["versao"] == versao:
+        df, cubo, razao = anterior["df"], anterior["cubo"], anterior["razao"]
+    else:
+        df = carregar_notas(path, leitor=leitor)
+        cubo = cubo_da_planilha(path, df)
+        razao = razao_da_planilha(path, cubo)
+    fechamentos = fechamentos_ativos(origem)
+    for ano_f, mes_f in divergencias(fechamentos, cubo):
+        logging.warning(f"[vigia] Notas de {mes_f:02d}/{ano_f} mudaram depois do fechamento")
+    return {
+        "path": path,
+        "versao": versao,
+        "versao_arquivo_fechamentos": versao_fechamentos,
+        "assinatura_fechamentos": assinatura_fechamentos(fechamentos),
+        "df": df,
+        "cubo": cubo,
+        "razao": razao,
+        "apuracoes": {
+            ano: calcular_resumo_fiscal_mes_a_mes(
+                df, ano, TODOS_OS_MESES, cubo=cubo, razao=razao, fechamentos=fechamentos
+            )
+            for ano in anos_correntes(cubo)
+        },
+    }
+
+
+def _publicar(origem, pacote=None, erro=None):
+    with _publicacao:
+        if pacote is not None:
+            _pacotes[origem] = pacote
+            _falhas.pop(origem, None)
+        else:
+            _falhas[origem] = erro
+        _publicacao.notify_all()
+
+
+def pacote_atual(origem):
+    """Último pacote publicado para ``origem`` (None antes do primeiro)."""
+    return _pacotes.get(Path(origem))
+
+
+def aguardar_pacote(origem, segundos=ESPERA_PRIMEIRO_PACOTE):
+    """Espera até ``segundos`` pelo primeiro pacote de ``origem``.
+
+    Desiste antes se o vigia já falhou ao prepará-lo (planilha inacessível
+    e sem cópia local, por exemplo); devolve None nesses casos.
+    """
+    origem = Path(origem)
+    with _publicacao:
+        _publicacao.wait_for(lambda: origem in _pacotes or origem in _falhas, timeout=segundos)
+        return _pacotes.get(origem)
+
+
+def apuracao_pronta(pacote, ano, meses, assinatura):
+    """Apuração pré-calculada do ``ano``, válida só para o ano inteiro e os mesmos fechamentos."""
+    if pacote is None or sorted(meses) != TODOS_OS_MESES or pacote["assinatura_fechamentos"] != assinatura:
+        return None
+    return pacote["apuracoes"].get(ano)
+
+
+def verificar(origem, leitor=None, usar_espelho=True):
+    """Uma rodada do vigia: republica o pacote de ``origem`` se a planilha ou os fechamentos mudaram."""
+    origem = Path(origem)
+    path = espelhar(origem) if usar_espelho else origem
+    atual = _pacotes.get(origem)
+    if atual is not None and atual["path"] == path and atual["versao"] == impressao_arquivo(path) \
+            and atual["versao_arquivo_fechamentos"] == impressao_arquivo(arquivo_fechamentos(origem)):
+        return False
+    pacote = preparar_pacote(origem, path, leitor, anterior=atual)
+    _publicar(origem, pacote)
+    logging.info(f"[vigia] Pacote de {origem} atualizado (versão {pacote['versao']})")
+    return True
+
+
+def aquecer_empresas(raiz, leitor=None):
+    """Atualiza os caches em disco (notas, cubo, razão) das planilhas das empresas que mudaram."""
+    for empresa, path in descobrir_empresas(raiz).items():
+        versao = impressao_arquivo(path)
+        if _aquecidas.get(path) == versao:
+            continue
+        try:
+            razao_da_planilha(path, cubo_da_planilha(path, carregar_notas(path, leitor=leitor)))
+            _aquecidas[path] = versao
+            logging.info(f"[vigia] Caches de {empresa} atualizados")
+        except Exception as e:
+            logging.warning(f"[vigia] Falha ao preparar {empresa} ({path}): {e}")
+
+
+def _vigiar(origem, raiz_empresas, intervalo, leitor, usar_espelho, parar):
+    ultima_varredura = None
+    while True:
+        try:
+            verificar(origem, leitor, usar_espelho)
+        except Exception as e:
+            logging.warning(f"[vigia] Falha ao preparar {origem}: {e}")
+            _publicar(origem, erro=e)
+        if raiz_empresas is not None and (
+            ultima_varredura is None or time.monotonic() - ultima_varredura >= INTERVALO_EMPRESAS
+        ):
+            ultima_varredura = time.monotonic()
+            try:
+                aquecer_empresas(raiz_empresas, leitor)
+            except OSError as e:
+                logging.warning(f"[vigia] Pasta de empresas indisponível ({raiz_empresas}): {e}")
+        if parar.wait(intervalo):
+            return
+
+
+def iniciar_vigia(origem, raiz_empresas=None, intervalo=INTERVALO_VIGIA, leitor=None, usar_espelho=True,
+                  parar=None):
+    """Inicia a thread daemon do vigia; ``parar.set()`` a encerra."""
+    parar = parar or threading.Event()
+    thread = threading.Thread(
+        target=_vigiar, args=(Path(origem), raiz_empresas, intervalo, leitor, usar_espelho, parar),
+        name="vigia-planilhas", daemon=True,
+    )
+    thread.start()
+    return thread